@@ -1,137 +1,2108 @@
 import time
 import random
 import math
+import array
+import mmap
+import os
+import queue
+import sys
+import threading
+import bisect
+import hashlib
+import heapq
+import itertools
+import struct
+import tempfile
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8; only backend="processes" needs it
+    shared_memory = None
 
-class StellarArray:
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; simulate_batch falls back to pure Python
+    np = None
+
+class BitStore:
+    # Bit-packed storage (wire, flip-flops) indexed like the old list of 0/1 ints.
+    # data is a bytearray, or a writable memoryview into a restored snapshot.
+    __slots__ = ("bits", "data")
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.data = bytearray((bits + 7) // 8)
+
+    def __len__(self):
+        return self.bits
+
+    def _index(self, i):
+        if i < 0:
+            i += self.bits
+        if not 0 <= i < self.bits:
+            raise IndexError("bit index out of range")
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[k] for k in range(*i.indices(self.bits))]
+        i = self._index(i)
+        return (self.data[i >> 3] >> (i & 7)) & 1
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            positions = range(*i.indices(self.bits))
+            values = list(value)
+            if len(values) != len(positions):  # Bits cannot be inserted or removed
+                raise ValueError(f"Cannot assign {len(values)} bits to a slice of {len(positions)}")
+            for k, v in zip(positions, values):
+                self[k] = v
+            return
+        i = self._index(i)
+        if value:
+            self.data[i >> 3] |= 1 << (i & 7)
+        else:
+            self.data[i >> 3] &= ~(1 << (i & 7)) & 0xFF
+
+    def __iter__(self):
+        for byte in self.data[:self.bits >> 3]:
+            for b in range(8):
+                yield (byte >> b) & 1
+        tail = self.bits & 7
+        if tail:
+            byte = self.data[-1]
+            for b in range(tail):
+                yield (byte >> b) & 1
+
+    def clear(self):
+        self.data[:] = bytes(len(self.data))
+
+
+REGISTER_MAX = 0xFFFF  # A register lane holds an unsigned 16-bit integer
+REGISTER_ERROR = f"Register values must be integers 0-{REGISTER_MAX}"
+
+
+def _register_tape(data):
+    # A tape as the array('H') the registers latch. Negatives, floats and values
+    # above REGISTER_MAX are a ValueError here, before anything is latched.
+    if isinstance(data, array.array) and data.typecode == "H":
+        return data
+    if isinstance(data, (bytes, bytearray)):
+        data = memoryview(data)  # One value per byte, not raw 16-bit words
+    try:
+        return array.array("H", data)
+    except (TypeError, OverflowError):
+        raise ValueError(REGISTER_ERROR) from None
+
+
+class Calculator:
+    # One calculator unit: its tube count and a packed register bank
+    __slots__ = ("tubes", "registers")
+
+    def __init__(self, tubes, registers=38):
+        self.tubes = tubes
+        # 8-bit registers modelled on 16-bit lanes so art angles (0-360) survive a latch
+        self.registers = array.array("H", bytes(2 * registers))
+
+    def __getitem__(self, key):
+        # Keep calculator["registers"] working for code written against the old dicts
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+
+# --- OUTPUT ---
+# Modes hand the output stage structured records; a record with no row/col is a
+# whole-grid figure (the AEC k or the CEA index). Text is only built by sinks
+# that need it.
+Record = namedtuple("Record", "row col value")
+_record = tuple.__new__  # _record(Record, (row, col, value)) skips the namedtuple __new__ frame
+
+RECORD_FORMATS = {
+    "aec": lambda r: f"Neutron multiplication factor k: {r.value:.2f}",
+    "cea": lambda r: f"Reactor criticality index: {r.value:.2f}",
+    "trading": lambda r: f"Trade at [{r.row},{r.col}]: Spread {r.value}",
+    "art": lambda r: f"Point [{r.row},{r.col}]: Angle {r.value:.1f}°",
+    "diff": lambda r: f"TICKER-[{r.row}][{r.col}]: {r.value:+d}",
+}
+
+
+def format_records(mode, records):
+    # Human-readable lines for a mode's records (plain str() for unknown modes)
+    fmt = RECORD_FORMATS.get(mode, str)
+    return [fmt(record) for record in records]
+
+
+class OutputSink:
+    # Base sink: emit() receives each output batch, message() the operator banners
+    def emit(self, mode, records):
+        pass
+
+    def message(self, text):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class NullSink(OutputSink):
+    # Discards everything; the cheapest sink for batch runs
+    pass
+
+
+class MemorySink(OutputSink):
+    # Keeps the raw (row, col, value) tuples, never formats them
+    def __init__(self):
+        self.records = []
+
+    def emit(self, mode, records):
+        self.records.extend(records)
+
+
+class PrintSink(OutputSink):
+    # The original console output: banners plus one "Output: [...]" line per batch
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def emit(self, mode, records):
+        print(f"Output: {format_records(mode, records)}", file=self.stream or sys.stdout)
+
+    def message(self, text):
+        print(text, file=self.stream or sys.stdout)
+
+
+class BufferedFileSink(OutputSink):
+    # Formatted lines, one per record, written through a large file buffer
+    def __init__(self, path, buffer_size=1 << 16):
+        self.file = open(path, "w", buffering=buffer_size, encoding="utf-8")
+
+    def emit(self, mode, records):
+        lines = format_records(mode, records)
+        if lines:
+            self.file.write("\n".join(lines) + "\n")
+
+    def message(self, text):
+        self.file.write(text + "\n")
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class ThreadedSink(OutputSink):
+    # Hands batches to a background thread so the machine never waits on I/O.
+    # The queue is bounded; a full queue makes the producer wait (backpressure).
+    # If the wrapped sink raises, the thread keeps draining and flush()/close()
+    # re-raise the first error. Once closed, it raises ValueError like a closed file.
+    def __init__(self, sink, maxsize=1024):
+        self.sink = sink
+        self.error = None
+        self.closed = False
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def _drain(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if item[0] == "emit":
+                    self.sink.emit(item[1], item[2])
+                elif item[0] == "message":
+                    self.sink.message(item[1])
+                else:
+                    self.sink.flush()
+            except Exception as exc:
+                if self.error is None:
+                    self.error = exc
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _check_open(self):
+        # Nothing drains the queue after close, so a put or join would block forever
+        if self.closed:
+            raise ValueError("ThreadedSink is closed")
+
+    def emit(self, mode, records):
+        self._check_open()
+        self.queue.put(("emit", mode, tuple(records)))  # The caller may reuse its list
+
+    def message(self, text):
+        self._check_open()
+        self.queue.put(("message", text))
+
+    def flush(self):
+        # Wait until everything queued so far has reached the wrapped sink
+        self._check_open()
+        self.queue.put(("flush",))
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.closed = True
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        try:
+            self.sink.close()
+        finally:
+            self._raise_error()
+
+
+# --- INSTRUMENTATION ---
+# Typed events. Phase events carry a count and the wall-clock seconds the phase
+# took. Per-node events (latches, thyratrons) are only produced while someone
+# subscribes to them.
+TapeBlockRead = namedtuple("TapeBlockRead", "count wall")
+StripeRouted = namedtuple("StripeRouted", "stripe count wall")
+RegisterLatched = namedtuple("RegisterLatched", "stripe register cell value")
+ThyratronFired = namedtuple("ThyratronFired", "row col value")
+AggregatorSweep = namedtuple("AggregatorSweep", "mode count records wall")
+OutputWritten = namedtuple("OutputWritten", "mode count wall")
+EVENTS = (TapeBlockRead, StripeRouted, RegisterLatched, ThyratronFired, AggregatorSweep, OutputWritten)
+PHASE_EVENTS = (TapeBlockRead, StripeRouted, AggregatorSweep, OutputWritten)
+
+
+class Hooks:
+    # Subscriber registry. Emit sites test `active` (and `wants()` for per-node
+    # events) before building an event, so an unobserved machine pays one
+    # attribute check per phase.
+    def __init__(self):
+        self.subscribers = {event: [] for event in EVENTS}
+        self.active = False
+
+    def subscribe(self, callback, *events):
+        # Call callback(event) for the given event types (all of them by default)
+        for event in events or EVENTS:
+            self.subscribers[event].append(callback)
+        self.active = True
+
+    def unsubscribe(self, callback):
+        for callbacks in self.subscribers.values():
+            while callback in callbacks:
+                callbacks.remove(callback)
+        self.active = any(self.subscribers.values())
+
+    def wants(self, event):
+        return self.active and bool(self.subscribers[event])
+
+    def emit(self, event):
+        for callback in self.subscribers[type(event)]:
+            callback(event)
+
+
+class PhaseProfiler:
+    # Built-in subscriber: event counts, items handled and wall time per phase
     def __init__(self):
-        # Simulate 700 tubes: 3 calculators at 166 tubes, 1 at 200
-        self.tubes = 700
-        self.calculators = [
-            {"tubes": 166, "registers": [0] * 38},  # ~300 bits, 8-bit registers
-            {"tubes": 166, "registers": [0] * 38},
-            {"tubes": 166, "registers": [0] * 38},
-            {"tubes": 200, "registers": [0] * 38}
-        ]
+        self.events = {}
+        self.items = {}
+        self.wall = {}
+
+    def __call__(self, event):
+        name = type(event).__name__
+        self.events[name] = self.events.get(name, 0) + 1
+        self.items[name] = self.items.get(name, 0) + (event.count if "count" in event._fields else 1)
+        self.wall[name] = self.wall.get(name, 0.0) + (event.wall if "wall" in event._fields else 0.0)
+
+    def attach(self, machine, per_node=False):
+        # Phase events only unless per_node: latches and thyratrons cost one event per node
+        machine.hooks.subscribe(self, *(EVENTS if per_node else PHASE_EVENTS))
+        return self
+
+    def report(self):
+        # Phases sorted hottest first, with their share of the observed wall time
+        total = sum(self.wall.values()) or 1.0
+        return sorted(({"phase": name, "events": count, "items": self.items[name],
+                        "wall": self.wall[name], "share": self.wall[name] / total}
+                       for name, count in self.events.items()),
+                      key=lambda row: row["wall"], reverse=True)
+
+    def format_report(self):
+        lines = [f"{'PHASE':<16}{'EVENTS':>10}{'ITEMS':>12}{'WALL (ms)':>12}{'SHARE':>8}"]
+        for row in self.report():
+            lines.append(f"{row['phase']:<16}{row['events']:>10}{row['items']:>12}"
+                         f"{row['wall'] * 1000:>12.3f}{row['share']:>8.1%}")
+        return "\n".join(lines)
+
+
+# --- TIMING ---
+TAPE_BITS_PER_S = 100  # Punched tape reader
+OUTPUT_BITS_PER_S = 10  # Output punch
+LATCH_S = 0.004  # ~4 ms per routed register operation
+SWEEP_S = 0.001  # ~1 ms per aggregator comparison
+SUBROUTINE_S = 22  # ~22 s of subroutine calls per reduction
+
+
+class TimingModel:
+    # Simulated time from operation counts. Every unit (tape reader, each stripe
+    # calculator, the aggregator, the output punch) keeps its own clock. A phase
+    # costs O(1): it starts when its unit is free and the previous phase of the same
+    # job is done. The tape reader can therefore read the next block while the
+    # calculators work on the last one.
+    def __init__(self, stripes, start=0.0):
+        self.units = ["tape"] + [f"calc{s}" for s in range(stripes)] + ["aggregator", "output"]
+        self.reset(start)
+
+    def reset(self, start=0.0):
+        self.clock = dict.fromkeys(self.units, start)
+        self.busy = dict.fromkeys(self.units, 0.0)
+        self.start = start
+        self.ready = start  # Finish time of the current job's latest phase
+
+    def _run(self, unit, seconds, begin):
+        finish = max(self.clock[unit], begin) + seconds
+        self.clock[unit] = finish
+        self.busy[unit] += seconds
+        return finish
+
+    def tape(self, values):
+        # A new block: the reader starts as soon as it has finished the last one
+        self.ready = self._run("tape", values * 8 / TAPE_BITS_PER_S, self.start)
+        return self.ready
+
+    def stripes(self, counts, seconds=LATCH_S):
+        # counts[s] operations on stripe calculator s, all in parallel
+        begin = self.ready
+        self.ready = max([self._run(f"calc{s}", n * seconds, begin) for s, n in enumerate(counts)] + [begin])
+        return self.ready
+
+    def aggregate(self, cells, fixed=SUBROUTINE_S):
+        self.ready = self._run("aggregator", cells * SWEEP_S + fixed, self.ready)
+        return self.ready
+
+    def output(self, values):
+        self.ready = self._run("output", values * 8 / OUTPUT_BITS_PER_S, self.ready)
+        return self.ready
+
+    @staticmethod
+    def grid_time(cells, counts, outputs):
+        # Closed form for one standalone grid: tape, slowest stripe, sweep, punch
+        return (cells * 8 / TAPE_BITS_PER_S + max(counts) * LATCH_S
+                + cells * SWEEP_S + SUBROUTINE_S + outputs * 8 / OUTPUT_BITS_PER_S)
+
+    @property
+    def makespan(self):
+        return max(self.clock.values()) - self.start
+
+    def report(self):
+        # Makespan plus busy time and utilization of every unit
+        makespan = self.makespan
+        return {
+            "makespan": makespan,
+            "units": {unit: {"busy": busy, "utilization": busy / makespan if makespan else 0.0}
+                      for unit, busy in self.busy.items()},
+        }
+
+
+# --- AGGREGATION ---
+class SignalIndex:
+    # Calculator 3's view of a swept grid. Every desk rule is settled in one pass:
+    # a rule is a threshold (signal when value > threshold) or a callable
+    # rule(row, col, value). Top-K, threshold, row and column queries run off one
+    # sorted (value, cell) index per stripe, built on the first query after a sweep.
+    def __init__(self, machine, rules=None):
+        self.machine = machine
+        self.rules = dict(rules if rules is not None else {"trading": 5})
+        self.values = []
+        self.fired = {}
+        self.batch_fired = []  # One {rule name: [Record, ...]} per grid of the last trading batch
+        self._keys = self._cells = None
+
+    def add_rule(self, name, rule):
+        self.rules[name] = rule
+
+    def sweep(self, values):
+        # Evaluate every rule over one grid (flat, row-major). Returns
+        # {rule name: [Record, ...]} with each desk's signals in grid order.
+        machine = self.machine
+        cols = machine.cols
+        self.values = values = list(values)
+        if len(values) != machine.cells:
+            raise ValueError(f"Sweep needs {machine.cells} values")
+        self._keys = self._cells = None
+        hits = {name: [] for name in self.rules}
+        thresholds = sorted((rule, name) for name, rule in self.rules.items() if not callable(rule))
+        callables = [(rule, hits[name]) for name, rule in self.rules.items() if callable(rule)]
+        lowest = thresholds[0][0] if thresholds else None
+        if len(thresholds) == 1 and not callables:  # The usual single desk
+            hits[thresholds[0][1]] = [Record(c // cols, c % cols, v) for c, v in enumerate(values) if v > lowest]
+            self.fired = hits
+            return hits
+        for c, v in enumerate(values):
+            if lowest is not None and v > lowest:  # Most nodes stop at the lowest threshold
+                for threshold, name in thresholds:
+                    if v <= threshold:
+                        break
+                    hits[name].append(Record(c // cols, c % cols, v))
+            for rule, found in callables:
+                if rule(c // cols, c % cols, v):
+                    found.append(Record(c // cols, c % cols, v))
+        self.fired = hits
+        return hits
+
+    def _index(self):
+        if self._keys is None:
+            cols, values = self.machine.cols, self.values
+            self._keys, self._cells = [], []
+            for first, stop in self.machine.stripe_bounds:
+                order = sorted(range(first * cols, stop * cols), key=values.__getitem__)
+                self._cells.append(order)
+                self._keys.append([values[c] for c in order])
+        return self._keys, self._cells
+
+    def above(self, threshold):
+        # Every node over threshold, in grid order. Stripes are row ranges, so only
+        # the matches inside each stripe need re-ordering.
+        cols, values = self.machine.cols, self.values
+        found = []
+        for keys, cells in zip(*self._index()):
+            found.extend(sorted(cells[bisect.bisect_right(keys, threshold):]))
+        return [Record(c // cols, c % cols, values[c]) for c in found]
+
+    def count_above(self, threshold):
+        return sum(len(keys) - bisect.bisect_right(keys, threshold) for keys in self._index()[0])
+
+    def top_k(self, k):
+        # The k largest values, largest first: a k-step merge of the stripe indexes
+        cols = self.machine.cols
+        runs = [zip(reversed(keys), reversed(cells)) for keys, cells in zip(*self._index())]
+        return [Record(c // cols, c % cols, v) for v, c in itertools.islice(heapq.merge(*runs, reverse=True), k)]
+
+    def row(self, i):
+        cols = self.machine.cols
+        return [Record(i, j, v) for j, v in enumerate(self.values[i * cols:(i + 1) * cols])]
+
+    def col(self, j):
+        return [Record(i, j, v) for i, v in enumerate(self.values[j::self.machine.cols])]
+
+
+# --- KERNELS ---
+class Kernel:
+    # A mode declared as stages that run fused, in one pass over each stripe's
+    # slice of the tape: map(value) -> value, then filter(value) -> bool picks the
+    # nodes reported as Records. With reduce(values) -> partial, each stripe yields
+    # one partial instead; the aggregator merges them with combine(partials) and
+    # finish(total, cells) gives the mode's single figure. collect(machine, values)
+    # receives the whole mapped tape, and needs_grid hands it the row-by-row grid
+    # from compute_grid instead. A map over integer inputs below `bound` is looked
+    # up in a table instead of being called per node; the table is built lazily
+    # and grows in powers of two to cover the largest value seen. A grown table is
+    # a new object, so threads still reading the old one see consistent entries.
+    __slots__ = ("name", "map", "filter", "reduce", "combine", "finish", "collect", "needs_grid", "banner",
+                 "bound", "_table", "_lock")
+
+    def __init__(self, name, map=None, filter=None, reduce=None, combine=None, finish=None, collect=None,
+                 needs_grid=False, banner=None, bound=None):
+        if needs_grid and collect is None:
+            raise ValueError("needs_grid kernels must supply collect(machine, grid)")
+        self.name = name
+        self.map = map
+        self.filter = filter
+        self.reduce = reduce
+        self.combine = combine or reduce
+        self.finish = finish
+        self.collect = collect
+        self.needs_grid = needs_grid
+        self.banner = banner or f"Starting {name} computation..."
+        self.bound = bound if map is not None else None
+        self._table = None
+        self._lock = threading.Lock()
+
+    def table(self, size=None):
+        # map() over at least 0..size-1 (all of 0..bound-1 by default); an
+        # array('d') when every entry is a float
+        size = self.bound if size is None else size
+        table = self._table
+        if table is not None and len(table) >= size:
+            return table
+        with self._lock:  # Backend threads may grow it at once
+            table = self._table
+            if table is None or len(table) < size:
+                have = 0 if table is None else len(table)
+                grow = min(self.bound, max(256, 1 << (size - 1).bit_length()))
+                extra = [self.map(v) for v in range(have, grow)]
+                floats = all(type(v) is float for v in extra)
+                if table is None:
+                    table = array.array("d") if floats else []
+                elif isinstance(table, array.array) and floats:
+                    table = array.array("d", table)
+                else:
+                    table = list(table)
+                table.extend(extra)
+                self._table = table  # Published whole, after it is filled
+            return table
+
+    def clear_table(self):
+        # Drop the lookup table; the next lookup rebuilds it from map()
+        with self._lock:
+            self._table = None
+
+    def mapper(self, values):
+        # The table lookup when every value indexes it, else the map stage itself
+        if self.bound is None:
+            return self.map
+        values = table_values(values, self.bound)
+        if values is None:
+            return self.map
+        return self.table(max(values) + 1 if len(values) else 1).__getitem__
+
+
+KERNELS = {}
+INT_TYPECODES = "bBhHiIlLqQ"
+
+
+def table_values(values, bound):
+    # values as an integer array when all of them index a table of `bound`
+    # entries, else None (floats, negatives or out-of-range values)
+    if isinstance(values, (bytes, bytearray)):
+        values = array.array("B", values)  # array("q", bytes) would reinterpret the raw bytes
+    elif not (isinstance(values, array.array) and values.typecode in INT_TYPECODES):
+        try:
+            values = array.array("q", values)
+        except (TypeError, OverflowError):
+            return None
+    if len(values) and (min(values) < 0 or max(values) >= bound):
+        return None
+    return values
+
+
+def register_kernel(name, **stages):
+    # Add (or replace) a mode; simulate() and simulate_batch() pick it up by name
+    KERNELS[name] = kernel = Kernel(name, **stages)
+    return kernel
+
+
+def _mean(total, cells):
+    return total / cells
+
+
+def _art_angle(value):
+    return math.sin(value * 0.1) * 360  # Map to 0-360 degrees
+
+
+def _desk_signals(machine, values):
+    # Every desk rule in one sweep; the first rule's signals go to output
+    fired = machine.signals.sweep(values)
+    return fired[next(iter(fired))] if fired else []
+
+
+# AEC: neutron multiplication factor k, the average neutron count.
+# CEA: reactor criticality, the average temperature/pressure reading.
+register_kernel("aec", reduce=sum, finish=_mean, banner="Starting AEC computation...")
+register_kernel("cea", reduce=sum, finish=_mean, banner="Starting CEA computation...")
+register_kernel("trading", collect=_desk_signals, banner="Starting trading computation...")
+register_kernel("art", map=_art_angle, bound=1 << 16, banner="Starting art generation...")  # Any register value
+BATCH_KERNELS = dict(KERNELS)  # The built-in modes, which have dedicated bulk paths
+
+
+def _latch_slice(registers, first, chunk):
+    # Leave a register bank as latching chunk cell by cell from cell `first`
+    # would: only the last len(registers) cells survive, copied in slices
+    nregs, n = len(registers), len(chunk)
+    k = max(0, n - nregs)
+    while k < n:
+        r = (first + k) % nregs
+        m = min(nregs - r, n - k)
+        registers[r:r + m] = chunk[k:k + m]
+        k += m
+
+
+BACKENDS = ("serial", "threads", "processes")
+
+
+def _latch_stripe(first_cell, values, registers):
+    # One calculator's share of compute_grid: route each value through the
+    # register bank and read the latched node back
+    latched = []
+    nregs = len(registers)
+    for k, value in enumerate(values):
+        reg_idx = (first_cell + k) % nregs
+        registers[reg_idx] = value
+        latched.append(registers[reg_idx])
+    return latched, registers
+
+
+def _latch_stripe_shared(name, first, stop, regs, nregs):
+    # Process worker: the segment holds the tape (overwritten with the latched
+    # grid) followed by a register image per stripe
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        cells = shm.buf.cast("q")
+        latched, registers = _latch_stripe(first, cells[first:stop].tolist(), cells[regs:regs + nregs].tolist())
+        cells[first:stop] = array.array("q", latched)
+        cells[regs:regs + nregs] = array.array("q", registers)
+        cells.release()
+    finally:
+        shm.close()
+
+
+def _batch_partials(tapes, computation_type, threshold=5):
+    # Numeric reduction of a run of tapes; Calculator 3 builds the records
+    if computation_type in ("aec", "cea"):
+        return [sum(tape) for tape in tapes]
+    if computation_type == "trading":
+        return [[v > threshold for v in tape] for tape in tapes]
+    table = _art_table(tapes)
+    return [[table[v] for v in tape] for tape in tapes]
+
+
+def _art_table(tapes):
+    # The art lookup table for a checked batch: register values always index it,
+    # so only its size depends on the tapes
+    return BATCH_KERNELS["art"].table(max(map(max, tapes), default=0) + 1)
+
+
+def _batch_partials_shared(in_name, out_name, start, stop, computation_type, size, threshold=5):
+    # Process worker: read tapes [start, stop) from the shared input and write the
+    # per-grid partials (sums, hit masks or angles) into the shared output
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    try:
+        cells = shm_in.buf.cast("H")
+        tapes = [cells[g * size:(g + 1) * size].tolist() for g in range(start, stop)]
+        cells.release()
+        partials = _batch_partials(tapes, computation_type, threshold)
+        if computation_type in ("aec", "cea"):
+            out = shm_out.buf.cast("q")
+            out[start:stop] = array.array("q", partials)
+        elif computation_type == "trading":
+            out = shm_out.buf
+            out[start * size:stop * size] = bytes(hit for mask in partials for hit in mask)
+        else:
+            out = shm_out.buf.cast("d")
+            out[start * size:stop * size] = array.array("d", [a for angles in partials for a in angles])
+        if out is not shm_out.buf:
+            out.release()
+    finally:
+        shm_in.close()
+        shm_out.close()
+
+
+class StellarArray:
+    def __init__(self, rows=15, cols=15, stripes=3, registers=38, backend="serial", workers=None, sink=None,
+                 rules=None):
+        # Grid geometry: rows x cols nodes, striped by row across `stripes`
+        # calculators plus one aggregator. The defaults are the 1946 machine.
+        # backend: "serial" runs everything on one core; "threads" or "processes"
+        # hand calculator stripes and batch chunks to a worker pool.
+        # sink receives every output batch; the default prints like the original.
+        if rows < 1 or cols < 1 or not 1 <= stripes <= rows:
+            raise ValueError("Grid needs at least one row per stripe")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}'")
+        if backend == "processes" and shared_memory is None:
+            raise ValueError("The processes backend needs Python 3.8+ (multiprocessing.shared_memory)")
+        self.rows = rows
+        self.cols = cols
+        self.cells = rows * cols
+        self.stripes = stripes
+        # Stripe s owns rows [s * rows // stripes, (s + 1) * rows // stripes): 0-4, 5-9, 10-14
+        self.stripe_bounds = [(s * rows // stripes, (s + 1) * rows // stripes) for s in range(stripes)]
+        self.row_stripe = [s for s, (first, stop) in enumerate(self.stripe_bounds) for _ in range(first, stop)]
+        self.backend = backend
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = None
+        # Simulate 700 tubes: 3 calculators at 166 tubes, 1 at 200 (166 more per extra stripe)
+        self.tubes = 700 + 166 * (stripes - 3)
+        self.calculators = [Calculator(166, registers) for _ in range(stripes)]  # ~300 bits, 8-bit registers
+        self.calculators.append(Calculator(200, registers))  # Aggregator
+        self.aggregator = self.calculators[-1]
         # 150,000-bit wire (~15,000 commands), ~464 flip-flops (~3,712 bits)
-        self.wire = [0] * 150000  # Simplified as a list
-        self.flip_flops = [0] * 3712  # 464 flip-flops, 8 bits each
-        self.time_delay = 0  # Track simulated time (seconds)
+        self.wire = BitStore(150000)  # 18,750 bytes, one bit per wire position
+        self.flip_flops = BitStore(8 * max(464, self.cells))  # 8 bits each (one byte apiece), one per node at least
+        self.thyratrons = BitStore(self.cells)  # One hit latch per grid node
+        self.latched = False  # Block A baseline held in the flip-flops
+        self.faults = {}  # Burnt-out tubes: stripe -> dead registers, or None for the whole stripe
+        self._dead = set()  # Cells that latch 0 because of those faults
+        self.sink = sink if sink is not None else PrintSink()
+        self.hooks = Hooks()
+        self.signals = SignalIndex(self, rules)  # Desk rules: name -> threshold or rule(row, col, value)
+        self.stripe_counts = [(stop - first) * cols for first, stop in self.stripe_bounds]
+        self.timing = TimingModel(stripes)  # Track simulated time (seconds)
+
+    @property
+    def time_delay(self):
+        # Simulated seconds since the last reset: the makespan across all units
+        return self.timing.makespan
+
+    @time_delay.setter
+    def time_delay(self, value):
+        self.timing.reset(value)
 
     def read_tape(self, data):
-        # Simulate punched tape input (~100 bits/s)
-        bits = len(data) * 8  # Assuming 8 bits per value
-        self.time_delay += bits / 100  # ~8 s for 800 bits
+        # Simulate punched tape input (~100 bits/s, 8 bits per value)
+        self.timing.tape(len(data))  # ~8 s for 800 bits
+        if not self.hooks.active:
+            return self._mask_dead(data) if self._dead else data
+        start = time.perf_counter()
+        if self._dead:
+            data = self._mask_dead(data)
+        self.hooks.emit(TapeBlockRead(len(data), time.perf_counter() - start))
+        return data
+
+    def burn_out(self, stripe, register=None):
+        # A tube failure in a stripe calculator: one register (or, with register=None,
+        # the control tubes and so the whole stripe) latches 0 until repair()
+        if not 0 <= stripe < self.stripes:
+            raise ValueError(f"No stripe calculator {stripe}")
+        if register is None:
+            self.faults[stripe] = None
+        elif not 0 <= register < len(self.calculators[stripe].registers):
+            raise ValueError(f"No register {register} on calculator {stripe}")
+        elif self.faults.get(stripe, ()) is not None:
+            self.faults.setdefault(stripe, set()).add(register)
+        self._dead = set(self.dead_cells())
+
+    def repair(self):
+        self.faults.clear()
+        self._dead = set()
+
+    def dead_cells(self):
+        # Cells whose register or stripe has burnt out, in tape order
+        dead = []
+        for stripe, registers in sorted(self.faults.items()):
+            first, stop = self.stripe_cells(stripe)
+            nregs = len(self.calculators[stripe].registers)
+            dead.extend(c for c in range(first, stop) if registers is None or c % nregs in registers)
+        return dead
+
+    def _mask_dead(self, data):
+        data = list(data)
+        for c in self._dead:
+            data[c] = 0
         return data
 
-    def write_output(self, data):
+    def write_output(self, data, mode=None):
         # Simulate nixie/output (~10 bits/s for tape, instant for nixie)
-        bits = len(data) * 8
-        self.time_delay += bits / 10  # ~80 s for 800 bits
-        print(f"Output: {data}")
+        self.timing.output(len(data))  # ~80 s for 800 bits
+        if not self.hooks.active:
+            self.sink.emit(mode, data)
+            return
+        start = time.perf_counter()
+        self.sink.emit(mode, data)
+        self.hooks.emit(OutputWritten(mode, len(data), time.perf_counter() - start))
 
-    def compute_15x15_grid(self, data):
-        # Simulate 15x15 grid computation (~225 points)
-        grid = [[0 for _ in range(15)] for _ in range(15)]
-        # Parallelize across 3 calculators (stocks 1-5, 6-10, 11-15)
-        for i in range(15):
-            for j in range(15):
-                calc_idx = (i // 5) % 3  # Assign to calculators 0, 1, 2
-                reg_idx = (i * 15 + j) % 38
-                self.calculators[calc_idx]["registers"][reg_idx] = data[i * 15 + j]
-                grid[i][j] = self.calculators[calc_idx]["registers"][reg_idx]
-                self.time_delay += 0.004  # ~4 ms per operation
+    def _emit_latches(self, stripe, first, values):
+        # RegisterLatched for a stripe's nodes, in tape order
+        if self.hooks.wants(RegisterLatched):
+            nregs = len(self.calculators[stripe].registers)
+            for cell, value in enumerate(values, first):
+                self.hooks.emit(RegisterLatched(stripe, cell % nregs, cell, value))
+
+    def _emit_fired(self, hits):
+        if self.hooks.wants(ThyratronFired):
+            for row, col, value in hits:
+                self.hooks.emit(ThyratronFired(row, col, value))
+
+    def _emit_sweep(self, mode, count, records, start):
+        self.hooks.emit(AggregatorSweep(mode, count, records, time.perf_counter() - start))
+
+    def _executor(self):
+        if self._pool is None:
+            if self.backend == "processes":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def close(self):
+        # Shut down the worker pool, if one was started
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def snapshot(self, target=None):
+        # The whole machine state (wire, flip-flops, thyratrons, registers, clocks)
+        # in the snapshot format. Returns bytes, or writes the sections straight to
+        # target, a path or a binary file. A path is written to a temporary file
+        # beside it and then renamed over it: a restored machine's bit stores may be
+        # mapped from that very file, and the old snapshot survives a failed write.
+        chunks = _snapshot_chunks(self)
+        if target is None:
+            return b"".join(chunks)
+        if hasattr(target, "write"):
+            for chunk in chunks:
+                target.write(chunk)
+            return target
+        fd, temp = tempfile.mkstemp(prefix=".snapshot-", dir=os.path.dirname(os.path.abspath(target)))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.chmod(temp, os.stat(target).st_mode & 0o777 if os.path.exists(target) else 0o644)
+            os.replace(temp, target)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        return target
+
+    def restore(self, source):
+        # Load a snapshot (a path, or bytes-like) into this machine of the same geometry.
+        # A path is memory-mapped copy-on-write: the bit stores point into the mapping
+        # and a page is only copied when the machine writes to it. Writable buffers
+        # (bytearray, mmap) are used in place; read-only bytes are copied once.
+        _load_snapshot(self, *_open_snapshot(source))
+        return self
+
+    @classmethod
+    def from_snapshot(cls, source, **options):
+        # A new machine with the snapshot's geometry and state; options (backend,
+        # sink, rules, ...) are passed to the constructor
+        header, view = _open_snapshot(source)
+        rows, cols, stripes, registers = header[3:7]
+        machine = cls(rows, cols, stripes, registers, **options)
+        _load_snapshot(machine, header, view)
+        return machine
+
+    def fork(self, count=None):
+        # Copy-on-write clones for what-if runs from this machine's current state. The
+        # state is written once to an unlinked temporary file that every clone maps
+        # privately, so clones share its pages until they write to them. Sink, rules
+        # and backend carry over (each clone starts its own pool). Returns one
+        # machine, or a list of count machines (empty for count=0).
+        if count is not None:
+            if count < 0:
+                raise ValueError("fork count must not be negative")
+            if count == 0:
+                return []
+        options = {"backend": self.backend, "workers": self.workers, "sink": self.sink,
+                   "rules": self.signals.rules}
+        with tempfile.TemporaryFile() as f:
+            self.snapshot(f)
+            f.flush()
+            clones = [self.from_snapshot(_map_snapshot(f.fileno()), **options) for _ in range(1 if count is None else count)]
+        for clone in clones:  # Faults are not in the snapshot format; clones inherit them here
+            clone.faults = {s: None if r is None else set(r) for s, r in self.faults.items()}
+            clone._dead = set(self._dead)
+        return clones if count is not None else clones[0]
+
+    def stripe_cells(self, stripe):
+        # First and stop cell index of a calculator's stripe
+        first, stop = self.stripe_bounds[stripe]
+        return first * self.cols, stop * self.cols
+
+    def _compute_grid_pooled(self, data):
+        # The stripes latch on separate workers; the aggregator collects them
+        stripes = self.calculators[:self.stripes]
+        cells = self.cells
+        start = time.perf_counter()
+        if self.backend == "threads":
+            futures = []
+            for s, calc in enumerate(stripes):
+                first, stop = self.stripe_cells(s)
+                futures.append(self._executor().submit(_latch_stripe, first, list(data[first:stop]),
+                                                       calc.registers.tolist()))
+            latched = []
+            for calc, future in zip(stripes, futures):
+                values, registers = future.result()
+                latched.extend(values)
+                calc.registers[:] = array.array("H", registers)
+        else:
+            nregs = len(stripes[0].registers)
+            shm = shared_memory.SharedMemory(create=True, size=(cells + self.stripes * nregs) * 8)
+            try:
+                shared = shm.buf.cast("q")
+                shared[:cells] = array.array("q", data)
+                futures = []
+                for s, calc in enumerate(stripes):
+                    regs = cells + s * nregs
+                    shared[regs:regs + nregs] = array.array("q", calc.registers)
+                    futures.append(self._executor().submit(_latch_stripe_shared, shm.name,
+                                                           *self.stripe_cells(s), regs, nregs))
+                for future in futures:
+                    future.result()
+                latched = shared[:cells].tolist()
+                for s, calc in enumerate(stripes):
+                    regs = cells + s * nregs
+                    calc.registers[:] = array.array("H", shared[regs:regs + nregs].tolist())
+                shared.release()
+            finally:
+                shm.close()
+                shm.unlink()
+        self.timing.stripes(self.stripe_counts)  # Same per-operation cost as the serial walk
+        if self.hooks.active:
+            wall = time.perf_counter() - start  # Stripes overlap, so each reports the whole wait
+            for s in range(self.stripes):
+                first, stop = self.stripe_cells(s)
+                self._emit_latches(s, first, latched[first:stop])
+                self.hooks.emit(StripeRouted(s, stop - first, wall))
+        cols = self.cols
+        return [latched[i * cols:(i + 1) * cols] for i in range(self.rows)]
+
+    def compute_grid(self, data):
+        # Simulate the grid computation (~225 points on the 15x15 machine)
+        data = _register_tape(data)
+        if self.backend != "serial":
+            return self._compute_grid_pooled(data)
+        cols = self.cols
+        hooks = self.hooks
+        grid = []
+        # Parallelize across the stripe calculators (stocks 1-5, 6-10, 11-15)
+        for s, (first, stop) in enumerate(self.stripe_bounds):
+            if hooks.active:
+                start = time.perf_counter()
+            registers = self.calculators[s].registers
+            nregs = len(registers)
+            for i in range(first, stop):
+                row = [0] * cols
+                for j in range(cols):
+                    reg_idx = (i * cols + j) % nregs
+                    registers[reg_idx] = data[i * cols + j]
+                    row[j] = registers[reg_idx]
+                grid.append(row)
+            if hooks.active:
+                wall = time.perf_counter() - start
+                self._emit_latches(s, first * cols, [v for row in grid[first:stop] for v in row])
+                hooks.emit(StripeRouted(s, (stop - first) * cols, wall))
+        self.timing.stripes(self.stripe_counts)  # ~4 ms per operation, stripes in parallel
         return grid
 
+    def compute_15x15_grid(self, data):
+        # Name from the original 15x15 machine; works for any geometry
+        return self.compute_grid(data)
+
     def aec_computation(self, neutron_data):
         # Simulate AEC computation (e.g., neutron multiplication factor k for Los Alamos)
-        print("Starting AEC computation...")
-        data = self.read_tape(neutron_data)  # ~225 neutron counts, ~800 bits
-        grid = self.compute_15x15_grid(data)  # Compute differences
-
-        # Calculate k (neutron multiplication factor) using fourth calculator
-        k = 0
-        for i in range(15):
-            for j in range(15):
-                # Simplified k calculation: sum neutron counts, normalize
-                k += grid[i][j]
-                self.time_delay += 0.001  # ~1 ms per operation
-        k = k / (15 * 15)  # Average neutron count
-        self.time_delay += 22  # ~22 s for comparisons
-        result = f"Neutron multiplication factor k: {k:.2f}"
-        self.write_output([result])
-        return result
+        return self.run_kernel("aec", neutron_data)
 
     def cea_computation(self, reactor_data):
         # Simulate CEA computation (e.g., 15x15 reactor criticality)
-        print("Starting CEA computation...")
-        data = self.read_tape(reactor_data)  # ~225 temperature/pressure points
-        grid = self.compute_15x15_grid(data)
-
-        # Calculate criticality (simplified: average temp/pressure)
-        criticality = 0
-        for i in range(15):
-            for j in range(15):
-                criticality += grid[i][j]
-                self.time_delay += 0.001
-        criticality = criticality / (15 * 15)
-        self.time_delay += 22  # ~22 s for comparisons
-        result = f"Reactor criticality index: {criticality:.2f}"
-        self.write_output([result])
-        return result
+        return self.run_kernel("cea", reactor_data)
 
     def trading_computation(self, price_data):
-        # Simulate trading computation (e.g., arbitrage on 15x15 grid)
-        print("Starting trading computation...")
-        data = self.read_tape(price_data)  # ~225 prices (NYSE vs. Curb)
-        grid = self.compute_15x15_grid(data)
-
-        # Identify arbitrage opportunities (spread > 5)
-        trades = []
-        for i in range(15):
-            for j in range(15):
-                self.time_delay += 0.001  # ~1 ms per comparison
-                if grid[i][j] > 5:  # Simplified threshold
-                    trades.append(f"Trade at [{i},{j}]: Spread {grid[i][j]}")
-        self.time_delay += 22  # ~22 s for subroutine calls
-        self.write_output(trades)
-        return trades
+        # Simulate trading computation (e.g., arbitrage on 15x15 grid): every desk
+        # rule in one sweep; self.signals.fired holds all of them
+        return self.run_kernel("trading", price_data)
 
     def art_generation(self, pattern_data):
         # Simulate art generation (e.g., fractal patterns for MoMA exhibit)
-        print("Starting art generation...")
-        data = self.read_tape(pattern_data)  # ~225 values for fractal angles
-        grid = self.compute_15x15_grid(data)
-
-        # Generate fractal-like pattern (simplified: sine-based angles)
-        artwork = []
-        for i in range(15):
-            for j in range(15):
-                angle = math.sin(grid[i][j] * 0.1) * 360  # Map to 0-360 degrees
-                self.time_delay += 0.001
-                artwork.append(f"Point [{i},{j}]: Angle {angle:.1f}°")
-        self.time_delay += 22  # ~22 s for processing
-        self.write_output(artwork)
-        return artwork
+        return self.run_kernel("art", pattern_data)
+
+    def run_kernel(self, kernel, data):
+        # One registered mode end to end: tape, fused stripe passes, Calculator 3, output.
+        # Returns a Record for reducing kernels, otherwise the list of Records.
+        if not isinstance(kernel, Kernel):
+            try:
+                kernel = KERNELS[kernel]
+            except KeyError:
+                raise ValueError("Unknown computation type") from None
+        self.sink.message(kernel.banner)
+        data = self.read_tape(data)
+        hooks = self.hooks
+        if kernel.needs_grid or self.backend != "serial":
+            # Latch through compute_grid (pooled or as the kernel asked), then run the stages
+            grid = self.compute_grid(data)
+            start = time.perf_counter() if hooks.active else 0.0
+            if kernel.needs_grid:
+                result = kernel.collect(self, grid)
+            else:
+                result = self._apply_kernel(kernel, [value for row in grid for value in row])
+        else:
+            stages = self._stripe_pass(kernel, data, latch=True)  # Reports its own StripeRouted time
+            start = time.perf_counter() if hooks.active else 0.0
+            result = self._combine(kernel, *stages)
+            self.timing.stripes(self.stripe_counts)  # ~4 ms per operation, stripes in parallel
+        records = [result] if isinstance(result, Record) else result
+        self.timing.aggregate(self.cells)  # ~1 ms per comparison, ~22 s for subroutine calls
+        if hooks.active:
+            self._emit_sweep(kernel.name, self.cells, len(records), start)
+            if kernel.collect is _desk_signals:
+                self._emit_fired(records)
+        self.write_output(records, kernel.name)
+        return result
+
+    def _apply_kernel(self, kernel, data, latch=False):
+        # The fused pass: each stripe's slice goes through map/filter/reduce once
+        # (latching its registers on the way when latch is set), and the stripe
+        # partials are combined as Calculator 3 would
+        return self._combine(kernel, *self._stripe_pass(kernel, data, latch))
+
+    def _stripe_pass(self, kernel, data, latch=False):
+        # The stripe half of the fused pass: (reduce partials, collect values, records)
+        cells, cols = self.cells, self.cols
+        if len(data) != cells:
+            raise ValueError(f"Tape must have {cells} values")
+        tape = _register_tape(data) if latch else data
+        hooks = self.hooks if latch else None
+        kfilter, reduce = kernel.filter, kernel.reduce
+        partials, values, records = [], [], []
+        for s, (first, stop) in enumerate(self.stripe_bounds):
+            if hooks is not None and hooks.active:
+                routed = time.perf_counter()
+            first, stop = first * cols, stop * cols
+            chunk = tape[first:stop]
+            if latch:
+                _latch_slice(self.calculators[s].registers, first, chunk)
+            mapped = chunk if kernel.map is None else map(kernel.mapper(chunk), chunk)
+            if reduce is not None:
+                partials.append(reduce(mapped if kfilter is None else filter(kfilter, mapped)))
+            elif kernel.collect is not None:
+                values.extend(mapped)
+            elif kfilter is None:
+                records.extend([Record(c // cols, c % cols, v) for c, v in enumerate(mapped, first)])
+            else:
+                records.extend([Record(c // cols, c % cols, v) for c, v in enumerate(mapped, first) if kfilter(v)])
+            if hooks is not None and hooks.active:
+                self._emit_latches(s, first, chunk)
+                hooks.emit(StripeRouted(s, stop - first, time.perf_counter() - routed))
+        return partials, values, records
+
+    def _combine(self, kernel, partials, values, records):
+        # Calculator 3's half: combine the stripe partials or collect the values
+        if kernel.reduce is not None:
+            total = kernel.combine(partials)
+            return Record(None, None, kernel.finish(total, self.cells) if kernel.finish else total)
+        if kernel.collect is not None:
+            return kernel.collect(self, values)
+        return records
 
     def simulate(self, input_data, computation_type):
-        print("Starting simulation...")
+        # Returns a Record for aec/cea and a list of Records for trading/art
+        self.sink.message("Starting simulation...")
         self.time_delay = 0  # Reset delay
-        if computation_type == "aec":
-            result = self.aec_computation(input_data)
-        elif computation_type == "cea":
-            result = self.cea_computation(input_data)
-        elif computation_type == "trading":
-            result = self.trading_computation(input_data)
-        elif computation_type == "art":
-            result = self.art_generation(input_data)
-        else:
+        if computation_type not in KERNELS:
             raise ValueError("Unknown computation type")
-        print(f"Total time: {self.time_delay:.2f} s")
+        result = self.run_kernel(computation_type, input_data)
+        self.sink.message(f"Total time: {self.time_delay:.2f} s")
         return result
 
+    def stream(self, block_a, ticks, threshold=5, emit=False):
+        # Latch Block A, then yield threshold hits for every Block B tape in ticks
+        engine = DifferentialStream(self, threshold, emit)
+        engine.latch_baseline(block_a)
+        return engine.run(ticks)
+
+    def resume(self, ticks, threshold=5, emit=False):
+        # Stream Block B tapes against the Block A already latched (e.g. by a restored snapshot)
+        return DifferentialStream(self, threshold, emit).run(ticks)
+
+    def incremental(self, tape, threshold=None):
+        # Latch a full tape, then apply sparse {cell: value} ticks with tick(). Signals
+        # follow the desk rules, or a single threshold when one is given.
+        return IncrementalGrid(self, tape, threshold)
+
+    def rolling(self, window=64, alpha=0.1, watch=()):
+        # Per-node rolling mean/variance/min/max/EWMA over successive tick() tapes
+        return RollingStats(self, window, alpha, watch)
+
+    def stream_file(self, path, threshold=5, emit=False):
+        # Replay a recorded tape file: every Block A re-latches the baseline and
+        # every Block B yields its hits, reading straight from the mapped file
+        with TapeReader(path, self.cells) as reader:
+            engine = DifferentialStream(self, threshold, emit)
+            for marker, block in reader:
+                if marker == BLOCK_A:
+                    engine.latch_baseline(block)
+                else:
+                    yield from engine.run((block,))
+                block.release()
+
+    def load_program(self, source):
+        # Assemble Étoile Code and punch it onto the wire, one 10-bit word at a time
+        words = []
+        for opcode, operand in assemble(source):
+            words.append(opcode)
+            if operand is not None:
+                words.append(operand)
+        if len(words) * WORD_BITS > len(self.wire):
+            raise ValueError("Program does not fit on the wire")
+        self.wire.clear()
+        for pc, word in enumerate(words):
+            for b in range(WORD_BITS):
+                if (word >> b) & 1:
+                    self.wire[pc * WORD_BITS + b] = 1
+        return len(words)
+
+    def _read_word(self, pc):
+        if (pc + 1) * WORD_BITS > len(self.wire):
+            raise RuntimeError("Program ran off the end of the wire")
+        word = 0
+        for b in range(WORD_BITS):
+            word |= self.wire[pc * WORD_BITS + b] << b
+        return word
+
+    def _decode(self, pc):
+        # Decode the instruction at pc: (opcode, operand, next pc)
+        opcode = self._read_word(pc)
+        if opcode not in ETOILE_MNEMONICS:
+            raise RuntimeError(f"Illegal opcode {opcode:#x} at word {pc}")
+        if ETOILE_MNEMONICS[opcode] in ETOILE_OPERANDS:
+            return opcode, self._read_word(pc + 1), pc + 2
+        return opcode, None, pc + 1
+
+    def decode_program(self):
+        # Read the wire back into (opcode, operand) pairs, up to and including HALT
+        program = []
+        pc = 0
+        while True:
+            opcode, operand, pc = self._decode(pc)
+            program.append((opcode, operand))
+            if opcode == ETOILE_OPCODES["HALT"]:
+                return program
+
+    def compile_program(self):
+        # Decode the wire once into a dispatch list; repeat runs reuse the closure
+        key = hashlib.blake2b(self.wire.data).digest()
+        with _COMPILED_LOCK:
+            program = _COMPILED_PROGRAMS.get(key)
+            if program is not None:
+                _COMPILED_PROGRAMS.move_to_end(key)
+                return program
+        steps = [(ETOILE_DISPATCH[opcode], operand) for opcode, operand in self.decode_program()]
+
+        def program(machine, state):
+            for handler, operand in steps:
+                if handler(machine, state, operand):
+                    return
+
+        with _COMPILED_LOCK:
+            _COMPILED_PROGRAMS[key] = program
+            if len(_COMPILED_PROGRAMS) > COMPILED_CACHE_SIZE:
+                _COMPILED_PROGRAMS.popitem(last=False)  # Least recently run
+        return program
+
+    def run_program(self, tape, compiled=True):
+        # Run the wire program against an iterable of tape blocks (lists, memoryviews
+        # or TapeReader pairs). Returns the final output records.
+        state = EtoileState(iter(tape))
+        if compiled:
+            self.compile_program()(self, state)
+        else:
+            pc = 0
+            while True:  # Interpret straight off the wire, decoding every word
+                opcode, operand, pc = self._decode(pc)
+                if ETOILE_DISPATCH[opcode](self, state, operand):
+                    break
+        return state.results
+
+    def _split_batch(self, grids):
+        # Accept a 2-D NumPy array, a flat array.array/memoryview of whole tapes,
+        # or any sequence of one-value-per-node tapes
+        cells = self.cells
+        message = f"Batch must have {cells} values per grid"
+        if np is not None and isinstance(grids, np.ndarray):
+            if grids.ndim == 1 and grids.size % cells == 0:
+                grids = grids.reshape(-1, cells)
+            if grids.ndim != 2 or grids.shape[1] != cells:
+                raise ValueError(message)
+            return grids
+        if isinstance(grids, (array.array, memoryview, bytes, bytearray)):
+            flat = memoryview(grids)  # Slice without copying the tape
+            if len(flat) % cells:
+                raise ValueError(message)
+            return [flat[k:k + cells] for k in range(0, len(flat), cells)]
+        tapes = list(grids)
+        for tape in tapes:
+            if len(tape) != cells:
+                raise ValueError(message)
+        return tapes
+
+    def _check_batch(self, tapes):
+        # Every tape must fit the registers before any of them runs. Returns the
+        # tapes as checked, so the bulk paths never convert a tape again.
+        if np is not None and isinstance(tapes, np.ndarray):
+            if tapes.size and (tapes.dtype.kind not in "biu" or tapes.min() < 0 or tapes.max() > REGISTER_MAX):
+                raise ValueError(REGISTER_ERROR)
+            return tapes
+        return [tape if isinstance(tape, memoryview) and tape.format in "BH" else _register_tape(tape)
+                for tape in tapes]
+
+    def _cell_coords(self):
+        # Row and column of every cell, so batch records skip the // and % per value
+        cols = self.cols
+        return [c // cols for c in range(self.cells)], [c % cols for c in range(self.cells)]
+
+    def _batch_threshold(self):
+        # The trading threshold when the desk rules are one threshold, which the bulk
+        # paths handle; None means every grid needs the full desk sweep
+        rules = list(self.signals.rules.values())
+        return rules[0] if len(rules) == 1 and not callable(rules[0]) else None
+
+    def _batch_desks(self, tapes):
+        # Several desks, or callable rules: one sweep per grid settles all of them
+        signals = self.signals
+        if np is not None and isinstance(tapes, np.ndarray):
+            tapes = tapes.tolist()
+        fired = signals.batch_fired = [signals.sweep(tape) for tape in tapes]
+        first = next(iter(signals.rules), None)
+        return [hits[first] if first is not None else [] for hits in fired]
+
+    def _batch_python(self, tapes, computation_type, threshold=5):
+        # One comprehension per grid instead of the register-by-register walk
+        cells = self.cells
+        if computation_type in ("aec", "cea"):
+            return [Record(None, None, sum(tape) / cells) for tape in tapes]
+        rows, cols = self._cell_coords()
+        if computation_type == "trading":
+            return [[_record(Record, (i, j, v)) for i, j, v in zip(rows, cols, tape) if v > threshold]
+                    for tape in tapes]
+        table = _art_table(tapes)
+        return [[_record(Record, (i, j, table[v])) for i, j, v in zip(rows, cols, tape)] for tape in tapes]
+
+    def _batch_numpy(self, tapes, computation_type, threshold=5):
+        # Reduce the whole batch at once; only the records are built per grid
+        if computation_type in ("aec", "cea"):
+            return [Record(None, None, k) for k in (tapes.sum(axis=1) / self.cells).tolist()]
+        rows, cols = self._cell_coords()
+        if computation_type == "trading":
+            mask = tapes > threshold
+            grid_idx, cells = np.nonzero(mask)
+            spreads = tapes[grid_idx, cells].tolist()
+            results = [[] for _ in range(len(tapes))]
+            for g, c, v in zip(grid_idx.tolist(), cells.tolist(), spreads):
+                results[g].append(_record(Record, (rows[c], cols[c], v)))
+            return results
+        top = int(tapes.max()) if tapes.size else 0  # _check_batch kept the values in register range
+        angles = np.asarray(KERNELS["art"].table(top + 1))[tapes.astype(np.intp)].tolist()  # Gather from the table
+        return [[_record(Record, (i, j, a)) for i, j, a in zip(rows, cols, row)] for row in angles]
+
+    def _format_partials(self, partials, computation_type):
+        # Calculator 3: turn per-grid partials into the same records as simulate()
+        cells = self.cells
+        if computation_type in ("aec", "cea"):
+            return [Record(None, None, total / cells) for total in partials]
+        rows, cols = self._cell_coords()
+        if computation_type == "trading":
+            return [[_record(Record, (i, j, v)) for i, j, v, hit in zip(rows, cols, tape, mask) if hit]
+                    for tape, mask in partials]
+        return [[_record(Record, (i, j, a)) for i, j, a in zip(rows, cols, angles)] for angles in partials]
+
+    def _batch_pooled(self, tapes, computation_type, threshold=5):
+        # Split the batch into contiguous chunks of grids, a few per worker
+        if np is not None and isinstance(tapes, np.ndarray):
+            tapes = tapes.tolist()
+        n = len(tapes)
+        step = max(1, -(-n // (self.workers * 4)))
+        chunks = [(start, min(start + step, n)) for start in range(0, n, step)]
+        if self.backend == "threads":
+            futures = [self._executor().submit(_batch_partials, tapes[start:stop], computation_type, threshold)
+                       for start, stop in chunks]
+            partials = [p for future in futures for p in future.result()]
+        else:
+            size = self.cells
+            out_size = {"aec": 8 * n, "cea": 8 * n, "trading": size * n}.get(computation_type, 8 * size * n)
+            shm_in = shared_memory.SharedMemory(create=True, size=2 * size * n)
+            shm_out = shared_memory.SharedMemory(create=True, size=out_size)
+            try:
+                cells = shm_in.buf.cast("H")  # Checked tapes fit the 16-bit registers
+                for g, tape in enumerate(tapes):
+                    cells[g * size:(g + 1) * size] = _register_tape(tape)
+                cells.release()
+                futures = [self._executor().submit(_batch_partials_shared, shm_in.name, shm_out.name,
+                                                   start, stop, computation_type, size, threshold)
+                           for start, stop in chunks]
+                for future in futures:
+                    future.result()
+                if computation_type in ("aec", "cea"):
+                    out = shm_out.buf.cast("q")
+                    partials = out.tolist()
+                elif computation_type == "trading":
+                    out = shm_out.buf
+                    partials = [out[g * size:(g + 1) * size].tolist() for g in range(n)]
+                else:
+                    out = shm_out.buf.cast("d")
+                    partials = [out[g * size:(g + 1) * size].tolist() for g in range(n)]
+                if out is not shm_out.buf:
+                    out.release()
+            finally:
+                shm_in.close()
+                shm_in.unlink()
+                shm_out.close()
+                shm_out.unlink()
+        if computation_type == "trading":
+            partials = list(zip(tapes, partials))
+        return self._format_partials(partials, computation_type)
+
+    def _latch_registers(self, data):
+        # Leave the register banks as compute_15x15_grid would after this tape
+        cols = self.cols
+        for i in range(self.rows):
+            registers = self.calculators[self.row_stripe[i]].registers
+            nregs = len(registers)
+            for j in range(cols):
+                registers[(i * cols + j) % nregs] = data[i * cols + j]
+
+    def simulate_batch(self, grids, computation_type):
+        # Run a whole batch of grid tapes in bulk. Returns (results, time_delays),
+        # one entry per grid, with results shaped as simulate() would return them.
+        # Each grid's records also go to the sink.
+        if computation_type not in KERNELS:
+            raise ValueError("Unknown computation type")
+        tapes = self._check_batch(self._split_batch(grids))
+        if self._dead:
+            if np is not None and isinstance(tapes, np.ndarray):
+                tapes = tapes.copy()
+                tapes[:, sorted(self._dead)] = 0
+            else:
+                tapes = [self._mask_dead(tape) for tape in tapes]
+        start = time.perf_counter() if self.hooks.active else 0.0
+        kernel = KERNELS[computation_type]
+        threshold = self._batch_threshold() if kernel is BATCH_KERNELS["trading"] else None
+        if kernel is not BATCH_KERNELS.get(computation_type):  # Registered kernels: the fused pass per grid
+            if np is not None and isinstance(tapes, np.ndarray):
+                tapes = tapes.tolist()
+            if kernel.needs_grid:
+                cols = self.cols
+                results = [kernel.collect(self, [list(tape[k:k + cols]) for k in range(0, self.cells, cols)])
+                           for tape in tapes]
+            else:
+                results = [self._apply_kernel(kernel, tape) for tape in tapes]
+        elif computation_type == "trading" and threshold is None:
+            results = self._batch_desks(tapes)
+        elif self.backend != "serial" and len(tapes) > 1:
+            results = self._batch_pooled(tapes, computation_type, threshold)
+        elif np is not None and isinstance(tapes, np.ndarray):
+            results = self._batch_numpy(tapes, computation_type, threshold)
+        else:
+            results = self._batch_python(tapes, computation_type, threshold)
+        if computation_type == "trading" and threshold is not None:
+            # The single desk's hits are the results; queries answer for the last grid
+            name = next(iter(self.signals.rules))
+            self.signals.batch_fired = [{name: records} for records in results]
+            if len(tapes):
+                self.signals.sweep(tapes[-1].tolist() if np is not None and isinstance(tapes, np.ndarray) else tapes[-1])
+
+        # time_delays[g] is the standalone cost of grid g; the machine's timeline
+        # pipelines the batch, so the tape reader moves on while calculators work
+        cells, counts, timing = self.cells, self.stripe_counts, self.timing
+        if self.hooks.active:
+            self._emit_sweep(computation_type, cells * len(tapes),
+                             sum(1 if isinstance(r, Record) else len(r) for r in results), start)
+        timing.reset()
+        time_delays = []
+        for result in results:
+            records = [result] if isinstance(result, Record) else result
+            timing.tape(cells)
+            timing.stripes(counts)
+            timing.aggregate(cells)
+            self.write_output(records, computation_type)
+            time_delays.append(TimingModel.grid_time(cells, counts, len(records)))
+        if len(tapes):
+            self._latch_registers(tapes[-1].tolist() if np is not None and isinstance(tapes, np.ndarray) else tapes[-1])
+        return results, time_delays
+
+class DifferentialStream:
+    # Headless two-pass differential program (see TRADING_CODE_EXAMPLE.md):
+    # Block A is latched into the flip-flop grid once, then each Block B tape is
+    # subtracted on the fly. Block B is never stored, so memory stays flat no
+    # matter how many ticks stream through. With emit, each tick's hits also go to
+    # the sink as "diff" output.
+    def __init__(self, machine, threshold=5, emit=False):
+        self.machine = machine
+        self.threshold = threshold
+        self.emit = emit
+        self.latched = machine.latched  # A restored machine may already hold Block A
+        self.ticks = 0
+
+    def latch_baseline(self, block_a, route=True):
+        # LOAD_GRID_LATCH: one flip-flop byte per grid node. With route, values pass
+        # through the stripe calculators' registers on the way, as in compute_grid.
+        machine = self.machine
+        cells = machine.cells
+        if len(block_a) != cells:
+            raise ValueError(f"Block A must have {cells} values")
+        data = machine.read_tape(block_a)
+        try:
+            baseline = bytes(data)
+        except ValueError:
+            raise ValueError("Block A values must fit an 8-bit flip-flop (0-255)") from None
+        if route:
+            machine.compute_grid(data)
+        else:
+            machine.timing.stripes(machine.stripe_counts)  # ~4 ms per latch
+        machine.flip_flops.data[:cells] = baseline
+        self.latched = machine.latched = True
+
+    def run(self, ticks):
+        # P_STREAM_OP_SUB: yields the Record(row, col, spread) hits of every Block B tape
+        if not self.latched:
+            raise RuntimeError("Block A must be latched before streaming Block B")
+        machine = self.machine
+        baseline = machine.flip_flops.data
+        threshold = self.threshold
+        cells, cols, counts = machine.cells, machine.cols, machine.stripe_counts
+        hooks = machine.hooks
+        for block_b in ticks:
+            if len(block_b) != cells:
+                raise ValueError(f"Block B must have {cells} values")
+            data = machine.read_tape(block_b)
+            if hooks.active:
+                start = time.perf_counter()
+            hits = []
+            for c, (curr, base) in enumerate(zip(data, baseline)):
+                if curr - base > threshold:  # Thyratron fires
+                    hits.append(Record(c // cols, c % cols, curr - base))
+            machine.timing.stripes(counts, LATCH_S + SWEEP_S)  # Subtract, then compare
+            if hooks.active:
+                machine._emit_sweep("diff", cells, len(hits), start)
+                machine._emit_fired(hits)
+            if self.emit:
+                machine.write_output(hits, "diff")
+            self.ticks += 1
+            yield hits
+
+
+class IncrementalGrid:
+    # Live grid for sparse ticks. A full tape is latched once; after that,
+    # update({cell: value}) marks cells dirty on their stripe and flush() re-latches
+    # only those cells, keeping the grid sum (the AEC k / CEA criticality mean) and
+    # the active trade signals current in O(changed cells). Each desk rule of the
+    # machine (taken when the grid is made) keeps its own active set; the first
+    # desk's is the one trading_computation outputs.
+    def __init__(self, machine, tape, threshold=None):
+        self.machine = machine
+        self.rules = dict(machine.signals.rules) if threshold is None else {"trading": threshold}
+        self.desks = {name: {} for name in self.rules}  # desk -> {cell: value} of its active signals
+        self.active = next(iter(self.desks.values()), {})  # The output desk
+        self.crossed = {}  # desk -> (fired, cleared) Records of the last flush
+        self.values = [0] * machine.cells
+        self.total = 0
+        self.dirty = [{} for _ in range(machine.stripes)]  # stripe -> {cell: value}
+        self.ticks = 0
+        self.load(tape)
+
+    def load(self, tape):
+        # Full recompute: the normal tape and routing path
+        machine = self.machine
+        grid = machine.compute_grid(machine.read_tape(tape))
+        self.values = [value for row in grid for value in row]
+        self.total = sum(self.values)
+        for name, fires, active in self._checks():
+            active.clear()
+            active.update((c, v) for c, v in enumerate(self.values) if fires(c, v))
+        for pending in self.dirty:
+            pending.clear()
+        machine.timing.aggregate(machine.cells)
+
+    def _checks(self):
+        # (desk, fires(cell, value), active set) per rule
+        cols = self.machine.cols
+        checks = []
+        for name, rule in self.rules.items():
+            if callable(rule):
+                fires = lambda c, v, rule=rule: rule(c // cols, c % cols, v)
+            else:
+                fires = lambda c, v, rule=rule: v > rule
+            checks.append((name, fires, self.desks[name]))
+        return checks
+
+    def update(self, changes):
+        # Queue {cell_index: value} changes; later values for a cell replace earlier ones.
+        # Cells on burnt-out registers latch 0, as on a full tape read.
+        machine = self.machine
+        cells, cols, row_stripe, dirty, dead = machine.cells, machine.cols, machine.row_stripe, self.dirty, machine._dead
+        for cell, value in changes.items():
+            if not 0 <= cell < cells:
+                raise IndexError(f"Cell {cell} outside the {machine.rows}x{cols} grid")
+            if not isinstance(value, int) or not 0 <= value <= REGISTER_MAX:
+                raise ValueError(REGISTER_ERROR)
+        for cell, value in changes.items():
+            dirty[row_stripe[cell // cols]][cell] = 0 if cell in dead else value
+        machine.timing.tape(2 * len(changes))  # Address and value per change
+
+    def flush(self):
+        # Re-latch the dirty cells and fold them into the aggregates. Returns the
+        # output desk's (fired, cleared) Records: signals that crossed its rule this
+        # tick. crossed holds them for every desk.
+        machine = self.machine
+        hooks, cols, values = machine.hooks, machine.cols, self.values
+        checks = self._checks()
+        crossed = {name: ([], []) for name in self.rules}
+        counts = []
+        start = time.perf_counter() if hooks.active else 0.0
+        for s, pending in enumerate(self.dirty):
+            counts.append(len(pending))
+            if not pending:
+                continue
+            if hooks.active:
+                routed = time.perf_counter()
+            registers = machine.calculators[s].registers
+            nregs = len(registers)
+            for cell, value in pending.items():
+                registers[cell % nregs] = value
+                self.total += value - values[cell]
+                values[cell] = value
+                for name, fires, active in checks:
+                    if fires(cell, value):
+                        if cell not in active:
+                            crossed[name][0].append(Record(cell // cols, cell % cols, value))
+                        active[cell] = value
+                    elif active.pop(cell, None) is not None:
+                        crossed[name][1].append(Record(cell // cols, cell % cols, value))
+            if hooks.active:
+                if hooks.wants(RegisterLatched):
+                    for cell, value in pending.items():
+                        hooks.emit(RegisterLatched(s, cell % nregs, cell, value))
+                hooks.emit(StripeRouted(s, len(pending), time.perf_counter() - routed))
+            pending.clear()
+        changed = sum(counts)
+        self.crossed = crossed
+        fired, cleared = next(iter(crossed.values()), ([], []))
+        machine.timing.stripes(counts)
+        machine.timing.aggregate(changed)
+        if hooks.active:
+            machine._emit_sweep("incremental", changed, sum(len(f) + len(c) for f, c in crossed.values()), start)
+            machine._emit_fired(fired)
+        self.ticks += 1
+        return fired, cleared
+
+    def tick(self, changes):
+        self.update(changes)
+        return self.flush()
+
+    @property
+    def mean(self):
+        # AEC k and the CEA criticality index are both the grid mean
+        return self.total / self.machine.cells
+
+    def trades(self, desk=None):
+        # A desk's active signals in grid order (the output desk's by default, as
+        # trading_computation reports them)
+        cols = self.machine.cols
+        active = self.active if desk is None else self.desks[desk]
+        return [Record(c // cols, c % cols, v) for c, v in sorted(active.items())]
+
+
+class RollingStats:
+    # Per-node statistics over the last `window` tapes of a tick sequence. Values
+    # sit in one array('d') ring (cells x window), so memory is fixed however long
+    # the run. Each tick updates every node in O(1): windowed Welford mean and
+    # variance, EWMA, and monotonic deques for min/max (amortized O(1)).
+    def __init__(self, machine, window=64, alpha=0.1, watch=()):
+        if window < 1:
+            raise ValueError("Window must hold at least one tick")
+        cells = machine.cells
+        self.machine = machine
+        self.window = window
+        self.alpha = alpha
+        self.ring = array.array("d", bytes(8 * cells * window))
+        self.means = array.array("d", bytes(8 * cells))
+        self.m2 = array.array("d", bytes(8 * cells))  # Sum of squared deviations in the window
+        self.ewmas = array.array("d", bytes(8 * cells))
+        self.lows = [deque() for _ in range(cells)]  # (tick, value), values increasing
+        self.highs = [deque() for _ in range(cells)]  # (tick, value), values decreasing
+        self.watches = {}
+        self.ticks = 0
+        for threshold in watch:
+            self.watch(threshold)
+
+    def watch(self, threshold):
+        # Track when each node's variance last rose above threshold; crossed()
+        # answers from this without keeping variance history
+        if threshold not in self.watches:
+            cells = self.machine.cells
+            above = bytearray(v > threshold for v in self.variances()) if self.ticks else bytearray(cells)
+            self.watches[threshold] = (above, array.array("q", [-1] * cells))
+
+    def tick(self, tape):
+        # One tape through the normal read and routing path, then into the window
+        machine = self.machine
+        grid = machine.compute_grid(machine.read_tape(tape))
+        return self.update([value for row in grid for value in row])
+
+    def update(self, values):
+        # Fold one grid (flat, row-major) into the window. Returns the number of
+        # watch crossings this tick.
+        machine = self.machine
+        cells, window, alpha, t = machine.cells, self.window, self.alpha, self.ticks
+        if len(values) != cells:
+            raise ValueError(f"Tick needs {cells} values")
+        start = time.perf_counter() if machine.hooks.active else 0.0
+        ring, means, m2, ewmas, lows, highs = self.ring, self.means, self.m2, self.ewmas, self.lows, self.highs
+        full = t >= window
+        count = window if full else t + 1
+        base = (t % window) * cells
+        expired = t - window
+        for c, x in enumerate(values):
+            slot = base + c
+            mean = means[c]
+            if full:  # Swap the oldest value for the new one
+                y = ring[slot]
+                new = mean + (x - y) / window
+                m2[c] += (x - y) * (x - new + y - mean)
+            else:
+                new = mean + (x - mean) / count
+                m2[c] += (x - mean) * (x - new)
+            means[c] = new
+            ring[slot] = x
+            ewmas[c] = ewmas[c] + alpha * (x - ewmas[c]) if t else x
+            low = lows[c]
+            while low and low[-1][1] >= x:
+                low.pop()
+            low.append((t, x))
+            if low[0][0] <= expired:
+                low.popleft()
+            high = highs[c]
+            while high and high[-1][1] <= x:
+                high.pop()
+            high.append((t, x))
+            if high[0][0] <= expired:
+                high.popleft()
+        crossings = 0
+        for threshold, (above, last) in self.watches.items():
+            for c in range(cells):
+                now = m2[c] / count > threshold
+                if now != above[c]:
+                    above[c] = now
+                    if now:
+                        last[c] = t
+                        crossings += 1
+        self.ticks += 1
+        machine.timing.aggregate(cells)
+        if machine.hooks.active:
+            machine._emit_sweep("rolling", cells, crossings, start)
+        return crossings
+
+    @property
+    def count(self):
+        return min(self.ticks, self.window)
+
+    def mean(self, cell):
+        return self.means[cell]
+
+    def variance(self, cell):
+        # Population variance of the window (0 until the first tick)
+        return max(0.0, self.m2[cell]) / self.count if self.ticks else 0.0
+
+    def variances(self):
+        count = self.count or 1
+        return [max(0.0, v) / count for v in self.m2]
+
+    def minimum(self, cell):
+        return self.lows[cell][0][1]
+
+    def maximum(self, cell):
+        return self.highs[cell][0][1]
+
+    def ewma(self, cell):
+        return self.ewmas[cell]
+
+    def crossed(self, threshold, last=None):
+        # Records (row, col, current variance) for nodes whose variance rose above
+        # threshold within the last `last` ticks (any time if None)
+        if threshold not in self.watches:
+            raise KeyError(f"Variance threshold {threshold} is not watched; call watch() first")
+        cols = self.machine.cols
+        since = -1 if last is None else self.ticks - last
+        recent = self.watches[threshold][1]
+        return [Record(c // cols, c % cols, self.variance(c)) for c, t in enumerate(recent) if t >= 0 and t >= since]
+
+
+# On-disk punched tape: each block is a marker byte, one byte per value, then the
+# same marker again (FF ... FF for Block A, FE ... FE for Block B). A file may hold
+# any number of blocks, e.g. one Block A baseline followed by a session of Block B.
+BLOCK_A = 0xFF
+BLOCK_B = 0xFE
+
+
+class TapeWriter:
+    # Punches blocks to a tape file through a buffered writer
+    def __init__(self, path, cells=225):
+        self.cells = cells
+        self.file = open(path, "wb")
+
+    def _punch(self, marker, values):
+        if len(values) != self.cells:
+            raise ValueError(f"Tape block must have {self.cells} values")
+        try:
+            body = bytes(values)
+        except ValueError:
+            raise ValueError("Tape values must fit one byte (0-255)") from None
+        self.file.write(bytes((marker,)) + body + bytes((marker,)))
+
+    def write_block_a(self, values):
+        self._punch(BLOCK_A, values)
+
+    def write_block_b(self, values):
+        self._punch(BLOCK_B, values)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_tape_file(path, block_a, blocks_b=(), cells=225):
+    # Punch a whole session: Block A baseline followed by every Block B tape
+    with TapeWriter(path, cells) as writer:
+        writer.write_block_a(block_a)
+        for block_b in blocks_b:
+            writer.write_block_b(block_b)
+
+
+class TapeReader:
+    # Memory-maps a tape file and yields (marker, memoryview) blocks without copying.
+    # The views point straight into the mapping, so drop them before close().
+    def __init__(self, path, cells=225):
+        self.cells = cells
+        self.file = open(path, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty files cannot be mapped
+            self.map = None
+        self.view = memoryview(self.map) if self.map is not None else memoryview(b"")
+
+    def __iter__(self):
+        view = self.view
+        cells = self.cells
+        pos = 0
+        end = len(view)
+        while pos < end:
+            marker = view[pos]
+            close = pos + cells + 1
+            if marker not in (BLOCK_A, BLOCK_B) or close >= end or view[close] != marker:
+                raise ValueError(f"Malformed tape block at byte {pos}")
+            yield marker, view[pos + 1:close]
+            pos = close + 1
+
+    def close(self):
+        self.view.release()
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass  # A caller still holds a block view; the mapping closes with it
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- SNAPSHOTS ---
+# One little-endian file per machine state: a header, the timing clocks (start,
+# ready, then clock and busy per unit), the wire, flip-flop and thyratron bytes as
+# they sit in memory, then every calculator's register bank. Each section starts on
+# an 8-byte boundary, so a mapped file can back the bit stores directly.
+SNAPSHOT_MAGIC = b"SAST"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = struct.Struct("<4sHHIIIIIII")  # magic, version, flags, rows, cols, stripes,
+                                                 # registers, wire/flip-flop/thyratron bits
+SNAPSHOT_LATCHED = 0x1  # Flag: Block A is latched in the flip-flops
+
+
+def _snapshot_layout(header):
+    # (offset, size) of the timing, wire, flip-flop, thyratron and register sections
+    stripes, registers, wire_bits, flip_bits, thyratron_bits = header[5:]
+    sizes = (16 * (stripes + 4), (wire_bits + 7) // 8, (flip_bits + 7) // 8, (thyratron_bits + 7) // 8,
+             2 * registers * (stripes + 1))
+    layout = []
+    pos = SNAPSHOT_HEADER.size
+    for size in sizes:
+        pos = (pos + 7) & ~7
+        layout.append((pos, size))
+        pos += size
+    return layout
+
+
+def _snapshot_chunks(machine):
+    # Header, padding and the state buffers themselves, ready to join or write
+    registers = len(machine.aggregator.registers)
+    if any(len(calc.registers) != registers for calc in machine.calculators):
+        raise ValueError("Snapshots need every calculator to have the same register count")
+    header = (SNAPSHOT_MAGIC, SNAPSHOT_VERSION, SNAPSHOT_LATCHED if machine.latched else 0, machine.rows,
+              machine.cols, machine.stripes, registers, machine.wire.bits, machine.flip_flops.bits,
+              machine.thyratrons.bits)
+    timing = machine.timing
+    clocks = array.array("d", (timing.start, timing.ready))
+    for unit in timing.units:
+        clocks.extend((timing.clock[unit], timing.busy[unit]))
+    banks = array.array("H")
+    for calc in machine.calculators:
+        banks.extend(calc.registers)
+    if sys.byteorder == "big":
+        clocks.byteswap()
+        banks.byteswap()
+    chunks = [SNAPSHOT_HEADER.pack(*header)]
+    pos = SNAPSHOT_HEADER.size
+    sections = (clocks, machine.wire.data, machine.flip_flops.data, machine.thyratrons.data, banks)
+    for (offset, size), section in zip(_snapshot_layout(header), sections):
+        chunks.append(bytes(offset - pos))
+        chunks.append(section)
+        pos = offset + size
+    return chunks
+
+
+def _map_snapshot(fileno):
+    # A private copy-on-write mapping of a snapshot file
+    try:
+        return mmap.mmap(fileno, 0, access=mmap.ACCESS_COPY)
+    except ValueError:  # Empty files cannot be mapped
+        raise ValueError("Snapshot is empty") from None
+
+
+def _open_snapshot(source):
+    # (header, writable byte view) for a snapshot path or buffer
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            source = _map_snapshot(f.fileno())
+    view = memoryview(source).cast("B")
+    if view.readonly:
+        view = memoryview(bytearray(view))
+    if len(view) < SNAPSHOT_HEADER.size:
+        raise ValueError("Snapshot is truncated")
+    header = SNAPSHOT_HEADER.unpack_from(view)
+    if header[0] != SNAPSHOT_MAGIC:
+        raise ValueError("Not a Stellar Array snapshot")
+    if header[1] != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version {header[1]}")
+    offset, size = _snapshot_layout(header)[-1]
+    if len(view) < offset + size:
+        raise ValueError("Snapshot is truncated")
+    return header, view
+
+
+def _load_snapshot(machine, header, view):
+    flags, rows, cols, stripes, registers, wire_bits, flip_bits, thyratron_bits = header[2:]
+    if (rows, cols, stripes, registers, wire_bits, flip_bits, thyratron_bits) != (
+            machine.rows, machine.cols, machine.stripes, len(machine.aggregator.registers),
+            machine.wire.bits, machine.flip_flops.bits, machine.thyratrons.bits):
+        raise ValueError("Snapshot geometry does not match this machine")
+    timing, wire, flip_flops, thyratrons, banks = [view[offset:offset + size]
+                                                   for offset, size in _snapshot_layout(header)]
+    clocks = array.array("d")
+    clocks.frombytes(timing)
+    values = array.array("H")
+    values.frombytes(banks)
+    if sys.byteorder == "big":
+        clocks.byteswap()
+        values.byteswap()
+    # The bit stores keep the views: nothing is copied until the machine writes
+    machine.wire.data = wire
+    machine.flip_flops.data = flip_flops
+    machine.thyratrons.data = thyratrons
+    for n, calc in enumerate(machine.calculators):
+        calc.registers[:] = values[n * registers:(n + 1) * registers]
+    t = machine.timing
+    t.start, t.ready = clocks[0], clocks[1]
+    for n, unit in enumerate(t.units):
+        t.clock[unit] = clocks[2 + 2 * n]
+        t.busy[unit] = clocks[3 + 2 * n]
+    machine.latched = bool(flags & SNAPSHOT_LATCHED)
+
+
+# --- ÉTOILE CODE ---
+# Each instruction is a 10-bit word on the wire (150,000 bits = 15,000 words).
+# Instructions that take an operand read it from the following word. A blank
+# wire decodes as HALT.
+WORD_BITS = 10
+ETOILE_OPCODES = {
+    "HALT": 0x00,
+    "SYS_RST": 0x01,
+    "MAP_STRIPE_STD": 0x02,
+    "IO_MODE_TAPE": 0x03,
+    "LOAD_GRID_LATCH": 0x04,
+    "P_LOAD_CONST": 0x05,
+    "P_STREAM_OP_SUB": 0x06,
+    "P_STREAM_OP_CMP": 0x07,
+    "M_LATCH_RESULTS": 0x08,
+    "IO_MODE_NIXIE": 0x09,
+    "M_OUT_ADDR_DIFF": 0x0A,
+}
+ETOILE_OPERANDS = {"P_LOAD_CONST"}
+ETOILE_MNEMONICS = {code: name for name, code in ETOILE_OPCODES.items()}
+
+# The differential arbitrage program from TRADING_CODE_EXAMPLE.md
+TRADING_DIFF_PROGRAM = """
+0001: SYS_RST              ; Reset all Vacuum Tubes
+0002: MAP_STRIPE_STD       ; Enable Standard Striping
+0003: IO_MODE_TAPE         ; Select Input
+0004: LOAD_GRID_LATCH      ; Read Block A into the Flip-Flop Grid
+0005: P_LOAD_CONST 0x05    ; Load Threshold '5' into Accumulator Shadow
+0006: P_STREAM_OP_SUB      ; Stream Block B, subtract, fire Thyratrons
+0007: M_LATCH_RESULTS      ; Capture the fired Thyratrons
+0008: IO_MODE_NIXIE        ; Select Output
+0009: M_OUT_ADDR_DIFF      ; Print Ticker and Calculated Spread for hits
+0010: HALT                 ; End of Cycle
+"""
+
+
+def assemble(source):
+    # Turn Étoile Code text into (opcode, operand) pairs. Accepts the listing
+    # format of the docs: optional "0001:" line numbers and ';' comments.
+    program = []
+    for line_no, line in enumerate(source.splitlines(), 1):
+        line = line.split(";", 1)[0].strip()
+        if not line:
+            continue
+        label, sep, rest = line.partition(":")
+        if sep and label.strip().isdigit():
+            line = rest.strip()
+            if not line:  # A numbered blank or comment-only line
+                continue
+        parts = line.split()
+        name = parts[0].upper()
+        if name not in ETOILE_OPCODES:
+            raise ValueError(f"Unknown Étoile instruction '{parts[0]}' on line {line_no}")
+        operand = None
+        if name in ETOILE_OPERANDS:
+            if len(parts) != 2:
+                raise ValueError(f"{name} needs one operand on line {line_no}")
+            text = parts[1]
+            try:  # Hex with 0x, else decimal: zero-padded decimals like 05 are common in listings
+                operand = int(text, 16) if text[:2].lower() == "0x" else int(text, 10)
+            except ValueError:
+                raise ValueError(f"Operand {parts[1]} is not a number on line {line_no}") from None
+            if not 0 <= operand < 1 << WORD_BITS:
+                raise ValueError(f"Operand {parts[1]} does not fit a wire word on line {line_no}")
+        elif len(parts) != 1:
+            raise ValueError(f"{name} takes no operand on line {line_no}")
+        program.append((ETOILE_OPCODES[name], operand))
+    return program
+
+
+class EtoileState:
+    # Working state of one program run (the non-wire parts of the machine)
+    __slots__ = ("tape", "acc", "input", "output", "striped", "stream", "hits", "results")
+
+    def __init__(self, tape):
+        self.tape = tape
+        self.acc = 0
+        self.input = None
+        self.output = None
+        self.striped = False
+        self.stream = None
+        self.hits = []
+        self.results = []
+
+
+def _next_block(state):
+    if state.input != "tape":
+        raise RuntimeError("Tape input not selected (IO_MODE_TAPE)")
+    try:
+        block = next(state.tape)
+    except StopIteration:
+        raise RuntimeError("Tape ran out before the program finished") from None
+    if isinstance(block, tuple):  # (marker, block) pairs from TapeReader
+        block = block[1]
+    return block
+
+
+def _op_halt(machine, state, operand):
+    return True
+
+
+def _op_sys_rst(machine, state, operand):
+    for calc in machine.calculators:
+        calc.registers[:] = array.array("H", bytes(2 * len(calc.registers)))
+    machine.flip_flops.clear()
+    machine.thyratrons.clear()
+    machine.latched = False
+    state.acc = 0
+    state.stream = None
+    state.hits = []
+
+
+def _op_map_stripe_std(machine, state, operand):
+    state.striped = True
+
+
+def _op_io_mode_tape(machine, state, operand):
+    state.input = "tape"
+
+
+def _op_load_grid_latch(machine, state, operand):
+    block = _next_block(state)
+    state.stream = DifferentialStream(machine, state.acc)
+    state.stream.latch_baseline(block, route=state.striped)  # Striping routes through the registers
+
+
+def _op_p_load_const(machine, state, operand):
+    state.acc = operand
+
+
+def _fire(machine, hits):
+    for row, col, spread in hits:
+        machine.thyratrons[row * machine.cols + col] = 1
+    return hits
+
+
+def _op_p_stream_op_sub(machine, state, operand):
+    if state.stream is None:
+        raise RuntimeError("P_STREAM_OP_SUB needs a latched grid (LOAD_GRID_LATCH)")
+    block = _next_block(state)
+    state.stream.threshold = state.acc
+    state.hits = _fire(machine, next(state.stream.run((block,))))
+
+
+def _op_p_stream_op_cmp(machine, state, operand):
+    # Compare the raw stream against the accumulator (no baseline)
+    data = machine.read_tape(_next_block(state))
+    acc = state.acc
+    cols = machine.cols
+    state.hits = _fire(machine, [(c // cols, c % cols, v) for c, v in enumerate(data) if v > acc])
+    machine._emit_fired(state.hits)
+    machine.timing.stripes(machine.stripe_counts, SWEEP_S)
+
+
+def _op_m_latch_results(machine, state, operand):
+    cols = machine.cols
+    state.results = [hit for hit in state.hits if machine.thyratrons[hit[0] * cols + hit[1]]]
+
+
+def _op_io_mode_nixie(machine, state, operand):
+    state.output = "nixie"
+
+
+def _op_m_out_addr_diff(machine, state, operand):
+    if state.output != "nixie":
+        raise RuntimeError("Nixie output not selected (IO_MODE_NIXIE)")
+    records = [Record(row, col, spread) for row, col, spread in state.results]
+    machine.write_output(records, "diff")
+    state.results = records
+
+
+ETOILE_DISPATCH = {
+    ETOILE_OPCODES["HALT"]: _op_halt,
+    ETOILE_OPCODES["SYS_RST"]: _op_sys_rst,
+    ETOILE_OPCODES["MAP_STRIPE_STD"]: _op_map_stripe_std,
+    ETOILE_OPCODES["IO_MODE_TAPE"]: _op_io_mode_tape,
+    ETOILE_OPCODES["LOAD_GRID_LATCH"]: _op_load_grid_latch,
+    ETOILE_OPCODES["P_LOAD_CONST"]: _op_p_load_const,
+    ETOILE_OPCODES["P_STREAM_OP_SUB"]: _op_p_stream_op_sub,
+    ETOILE_OPCODES["P_STREAM_OP_CMP"]: _op_p_stream_op_cmp,
+    ETOILE_OPCODES["M_LATCH_RESULTS"]: _op_m_latch_results,
+    ETOILE_OPCODES["IO_MODE_NIXIE"]: _op_io_mode_nixie,
+    ETOILE_OPCODES["M_OUT_ADDR_DIFF"]: _op_m_out_addr_diff,
+}
+
+# Compiled programs keyed by a digest of the wire, shared by every machine in the
+# process. Only the most recently run ones are kept, so programs that differ in a
+# single constant do not pile up.
+COMPILED_CACHE_SIZE = 32
+_COMPILED_PROGRAMS = OrderedDict()
+_COMPILED_LOCK = threading.Lock()
+
+
 # Test the simulator with different computations
 if __name__ == "__main__":
-    array = StellarArray()
+    stellar = StellarArray()  # Not `array`: that would shadow the array module
     # Test data: 15x15 grid (~225 points)
     neutron_data = [random.randint(0, 10) for _ in range(225)]  # AEC: Neutron counts
     reactor_data = [random.randint(20, 80) for _ in range(225)]  # CEA: Temp/pressure
@@ -140,10 +2111,10 @@ if __name__ == "__main__":
 
     # Run simulations
     print("\n=== AEC Simulation ===")
-    array.simulate(neutron_data, "aec")
+    stellar.simulate(neutron_data, "aec")
     print("\n=== CEA Simulation ===")
-    array.simulate(reactor_data, "cea")
+    stellar.simulate(reactor_data, "cea")
     print("\n=== Trading Simulation ===")
-    array.simulate(price_data, "trading")
+    stellar.simulate(price_data, "trading")
     print("\n=== Art Simulation ===")
-    array.simulate(pattern_data, "art")
\ No newline at end of file
+    stellar.simulate(pattern_data, "art")
\ No newline at end of file
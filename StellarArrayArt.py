@@ -0,0 +1,133 @@
+import array
+import colorsys
+import os
+import sys
+
+from StellarArray import KERNELS, table_values
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; frames are built with bytes tables instead
+    np = None
+
+# Whole-frame art output. Every angle is reduced to an 8-bit level (-360° black,
+# +360° white), so a frame is one table lookup per node and the image rows are
+# joined from pre-scaled pixel blocks instead of being formatted cell by cell.
+LEVELS = 256
+
+
+def _level(angle):
+    return min(LEVELS - 1, int((angle + 360) * LEVELS / 720))
+
+
+def _hue(level):
+    # PPM palette: the level's angle as a hue around the colour wheel
+    r, g, b = colorsys.hsv_to_rgb(level / LEVELS, 1.0, 1.0)
+    return bytes((int(r * 255), int(g * 255), int(b * 255)))
+
+
+class ArtFrames:
+    # Renders art-mode tapes (one value per node) as raw angle arrays or PGM/PPM
+    # frames. scale enlarges every node to a scale x scale pixel block.
+    def __init__(self, rows=15, cols=15, scale=1):
+        self.rows = rows
+        self.cols = cols
+        self.cells = rows * cols
+        self.scale = scale
+        self.kernel = KERNELS["art"]
+        self._levels = b""  # Value -> 8-bit level, grown with the art table
+        self._blocks = {}  # Image kind -> pixel block per level, pre-scaled
+
+    @classmethod
+    def for_machine(cls, machine, scale=1):
+        return cls(machine.rows, machine.cols, scale)
+
+    def _check(self, tape):
+        values = table_values(tape, self.kernel.bound)
+        if values is None or len(values) != self.cells:
+            raise ValueError(f"Art frames need {self.cells} integer values (0-{self.kernel.bound - 1})")
+        return values
+
+    def angles(self, tape):
+        # The frame's angles as array('d'), exactly as art mode computes them
+        values = self._check(tape)
+        table = self.kernel.table(max(values) + 1)
+        return array.array("d", map(table.__getitem__, values))
+
+    def angle_frames(self, tapes):
+        # A whole sequence at once: a (frames, rows, cols) NumPy array when NumPy is
+        # installed, otherwise one array('d') per frame
+        if np is not None:
+            frames = np.asarray(tapes)
+            if frames.dtype.kind not in "iu" or frames.size and (frames.min() < 0 or frames.max() >= self.kernel.bound):
+                raise ValueError(f"Art frames need integer values (0-{self.kernel.bound - 1})")
+            table = np.asarray(self.kernel.table(int(frames.max()) + 1 if frames.size else 1))
+            return table[frames].reshape(len(frames), self.rows, self.cols)
+        return [self.angles(tape) for tape in tapes]
+
+    def levels(self, tape):
+        # One 8-bit level per node, as bytes
+        values = self._check(tape)
+        need = max(values) + 1
+        if len(self._levels) < need:
+            table = self.kernel.table(need)
+            self._levels = bytes(_level(a) for a in table)
+        if isinstance(tape, (bytes, bytearray)):
+            return tape.translate(self._levels[:256])  # 8-bit tape: a single C call
+        return bytes(map(self._levels.__getitem__, values))
+
+    def _pixels(self, levels, kind):
+        blocks = self._blocks.get(kind)
+        if blocks is None:
+            pixel = (lambda l: bytes((l,))) if kind == "pgm" else _hue
+            blocks = self._blocks[kind] = [pixel(l) * self.scale for l in range(LEVELS)]
+        if self.scale == 1 and kind == "pgm":
+            return levels
+        cols, scale = self.cols, self.scale
+        rows = []
+        for r in range(self.rows):
+            row = b"".join(map(blocks.__getitem__, levels[r * cols:(r + 1) * cols]))
+            rows.append(row * scale)
+        return b"".join(rows)
+
+    def pgm(self, tape):
+        # Binary greyscale (P5) image bytes
+        width, height = self.cols * self.scale, self.rows * self.scale
+        return b"P5\n%d %d\n255\n" % (width, height) + self._pixels(self.levels(tape), "pgm")
+
+    def ppm(self, tape):
+        # Binary colour (P6) image bytes, hue by angle
+        width, height = self.cols * self.scale, self.rows * self.scale
+        return b"P6\n%d %d\n255\n" % (width, height) + self._pixels(self.levels(tape), "ppm")
+
+    def write_sequence(self, tapes, directory, kind="pgm", prefix="frame"):
+        # One image file per tape (frame00000.pgm, ...); returns the paths
+        render = {"pgm": self.pgm, "ppm": self.ppm}[kind]
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for n, tape in enumerate(tapes):
+            path = os.path.join(directory, f"{prefix}{n:05d}.{kind}")
+            with open(path, "wb") as f:
+                f.write(render(tape))
+            paths.append(path)
+        return paths
+
+    def write_angles(self, tapes, path):
+        # Raw float64 angles, frame after frame (native byte order); returns the frame count
+        count = 0
+        with open(path, "wb") as f:
+            for tape in tapes:
+                self.angles(tape).tofile(f)
+                count += 1
+        return count
+
+
+if __name__ == "__main__":
+    # Render a short random animation: python StellarArrayArt.py [directory] [frames]
+    import random
+    directory = sys.argv[1] if len(sys.argv) > 1 else "art_frames"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    frames = ArtFrames(scale=16)
+    tapes = [[random.randint(0, 360) for _ in range(frames.cells)] for _ in range(count)]
+    paths = frames.write_sequence(tapes, directory, "ppm")
+    print(f"Wrote {len(paths)} frames to {directory}")
@@ -0,0 +1,299 @@
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from StellarArray import KERNELS, AggregatorSweep, NullSink, StellarArray, StripeRouted
+
+MODES = ("aec", "cea", "trading", "art")
+# Tape value ranges used by the StellarArray.py demo for each mode
+VALUE_RANGES = {"aec": (0, 10), "cea": (20, 80), "trading": (0, 10), "art": (0, 360)}
+# Metrics checked against the baseline (tail percentiles and allocation counts are too
+# noisy to gate on), and the ones where a bigger number is better
+GATED = {"grids_per_s", "steps_per_s", "latency.p50_ms", "peak_bytes"}
+HIGHER_IS_BETTER = {"grids_per_s", "steps_per_s"}
+
+
+def make_tapes(mode, cells, count, rng):
+    low, high = VALUE_RANGES[mode]
+    return [[rng.randint(low, high) for _ in range(cells)] for _ in range(count)]
+
+
+def percentiles(samples):
+    # p50/p90/p99 of a list of seconds, reported in milliseconds
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+    return {"p50_ms": pick(0.50), "p90_ms": pick(0.90), "p99_ms": pick(0.99)}
+
+
+class PhaseTimer:
+    # Wraps a machine's phase methods with wall-clock timers. The fused kernel pass
+    # latches without calling compute_grid, so its stripe time ("stripe_pass") is
+    # summed from the StripeRouted events of each run instead.
+    PHASES = ("read_tape", "compute_grid", "stripe_pass", "write_output")
+    WRAPPED = ("read_tape", "compute_grid", "write_output")
+
+    def __init__(self, machine):
+        self.samples = {phase: [] for phase in self.PHASES}
+        self._routed = None  # Stripe seconds of the current run, outside compute_grid
+        for phase in self.WRAPPED:
+            setattr(machine, phase, self._wrap(phase, getattr(machine, phase)))
+        machine.hooks.subscribe(self._stripe, StripeRouted)
+
+    def _stripe(self, event):
+        if self._routed is not None:
+            self._routed += event.wall
+
+    def _wrap(self, phase, method):
+        samples = self.samples[phase]
+
+        def timed(*args, **kwargs):
+            if phase == "read_tape":
+                self._routed = 0.0
+            elif phase == "compute_grid":
+                self._routed = None  # Its stripes are part of its own sample
+            elif self._routed is not None:
+                self.samples["stripe_pass"].append(self._routed)
+                self._routed = None
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            samples.append(time.perf_counter() - start)
+            return result
+        return timed
+
+
+def measure_memory(run):
+    # Peak traced bytes during run(), plus what it allocated. CPython keeps no
+    # running total of allocations, only live counts, so both counts are net of
+    # what the run freed again: memory blocks, and objects tracked by the garbage
+    # collector (its generation-0 count, with collection paused so it is not reset).
+    enabled = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    tracemalloc.start()
+    try:
+        blocks = sys.getallocatedblocks()
+        objects = gc.get_count()[0]
+        kept = run()
+        allocated = gc.get_count()[0] - objects
+        retained = sys.getallocatedblocks() - blocks
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+        if enabled:
+            gc.enable()
+    del kept
+    return {"peak_bytes": peak, "allocated_objects": allocated, "retained_blocks": retained}
+
+
+def bench_simulator(mode, size, batch, repeats, rng):
+    machine = StellarArray(rows=size, cols=size, sink=NullSink())
+    tapes = make_tapes(mode, machine.cells, batch, rng)
+    totals = []
+    machine.simulate_batch(tapes[:1], mode)  # Warm up
+    if batch == 1:
+        # Single simulate() calls. The totals come from this machine, which has no
+        # hook subscribers; the phase breakdown from a second, instrumented one.
+        for _ in range(repeats):
+            start = time.perf_counter()
+            machine.simulate(tapes[0], mode)
+            totals.append(time.perf_counter() - start)
+        probe = StellarArray(rows=size, cols=size, sink=NullSink())
+        probe.simulate_batch(tapes[:1], mode)  # Warm up
+        timer = PhaseTimer(probe)
+        probed = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            probe.simulate(tapes[0], mode)
+            probed.append(time.perf_counter() - start)
+        phases = {phase: percentiles(samples) for phase, samples in timer.samples.items() if samples}
+        ran = [p for p in PhaseTimer.PHASES if len(timer.samples[p]) == len(probed)]
+        reduce = [total - sum(timer.samples[p][k] for p in ran) for k, total in enumerate(probed)]
+        phases["reduce"] = percentiles(reduce)
+        run = lambda: machine.simulate(tapes[0], mode)
+    else:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            machine.simulate_batch(tapes, mode)
+            totals.append(time.perf_counter() - start)
+        # Batches skip read_tape and compute_grid: the machine's sweep event times
+        # the tape conversion and kernel, write_output runs once per grid, and
+        # "reduce" is the timing model and register latch left over
+        probe = StellarArray(rows=size, cols=size, sink=NullSink())
+        probe.simulate_batch(tapes[:1], mode)  # Warm up
+        timer = PhaseTimer(probe)
+        sweeps = []
+        probe.hooks.subscribe(lambda event: sweeps.append(event.wall), AggregatorSweep)
+        written = timer.samples["write_output"]
+        kernel, output, reduce = [], [], []
+        for _ in range(repeats):
+            swept, wrote = len(sweeps), len(written)
+            start = time.perf_counter()
+            probe.simulate_batch(tapes, mode)
+            total = time.perf_counter() - start
+            kernel.append(sum(sweeps[swept:]))
+            output.append(sum(written[wrote:]))
+            reduce.append(total - kernel[-1] - output[-1])
+        phases = {"kernel": percentiles(kernel), "write_output": percentiles(output), "reduce": percentiles(reduce)}
+        run = lambda: machine.simulate_batch(tapes, mode)
+    result = {
+        "grids_per_s": batch * len(totals) / sum(totals),
+        "latency": percentiles(totals),
+        "phases": phases,
+    }
+    result.update(measure_memory(run))
+    return result
+
+
+class _HeadlessVisualizer:
+    # Stands in for the Tk window: every drawing call is a no-op
+    def __init__(self, machine):
+        self.machine = machine
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def bench_engine(size, repeats):
+    # Step-generation speed of the visualizer engine with drawing stubbed out
+    try:
+        from StellarArrayVisualizer import SimulationEngine
+    except ImportError:  # No Tk on this interpreter
+        return None
+    durations = []
+    steps = 0
+    for _ in range(repeats):
+        engine = SimulationEngine("trading", _HeadlessVisualizer(StellarArray(rows=size, cols=size)))
+        start = time.perf_counter()
+        while not engine.is_complete:
+            engine.step()
+            steps += 1
+        durations.append(time.perf_counter() - start)
+    return {"steps_per_s": steps / sum(durations), "latency": percentiles(durations)}
+
+
+def run_suite(modes, sizes, batches, repeats, seed):
+    rng = random.Random(seed)
+    results = {}
+    for mode in modes:
+        for size in sizes:
+            for batch in batches:
+                key = f"{mode}/{size}x{size}/batch{batch}"
+                results[key] = bench_simulator(mode, size, batch, repeats, rng)
+                print(f"{key}: {results[key]['grids_per_s']:.1f} grids/s", file=sys.stderr)
+    for size in sizes:
+        engine = bench_engine(size, max(1, repeats // 5))
+        if engine is not None:
+            results[f"engine/{size}x{size}"] = engine
+            print(f"engine/{size}x{size}: {engine['steps_per_s']:.0f} steps/s", file=sys.stderr)
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "repeats": repeats,
+            "seed": seed,
+        },
+        "results": results,
+    }
+
+
+def _flatten(metrics, prefix=""):
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{name}.")
+        else:
+            yield f"{prefix}{name}", name, value
+
+
+def compare(current, baseline, tolerance):
+    # List every metric that got worse than the baseline by more than tolerance
+    regressions = []
+    for key, metrics in current["results"].items():
+        base = baseline["results"].get(key)
+        if base is None:
+            continue
+        base_flat = {path: value for path, _, value in _flatten(base)}
+        for path, name, value in _flatten(metrics):
+            old = base_flat.get(path)
+            if path not in GATED or not old:
+                continue
+            change = (value - old) / old
+            worse = -change if name in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                regressions.append({"case": key, "metric": path, "baseline": old, "current": value,
+                                    "change": change})
+    return regressions
+
+
+def check_backends(seed, rounds=5):
+    # The threads backend must return exactly what serial does. Art grids alternate
+    # wide and narrow values against a small lookup table, so the worker threads
+    # race to grow it. Returns the modes whose results differ.
+    rng = random.Random(seed)
+    serial = StellarArray(sink=NullSink())
+    threaded = StellarArray(backend="threads", workers=2, sink=NullSink())
+    failures = []
+    try:
+        for mode in MODES:
+            if mode == "art":
+                tapes = [[rng.randint(0, 700 if g % 2 else 65535) for _ in range(serial.cells)] for g in range(8)]
+            else:
+                tapes = make_tapes(mode, serial.cells, 8, rng)
+            expected = serial.simulate_batch(tapes, mode)
+            kernel = KERNELS[mode]
+            for _ in range(rounds):
+                if kernel.bound is not None:
+                    kernel.clear_table()
+                    kernel.table(256)
+                # A table grown out of order would also corrupt later serial runs
+                if threaded.simulate_batch(tapes, mode) != expected or serial.simulate_batch(tapes, mode) != expected:
+                    failures.append(mode)
+                    break
+    finally:
+        threaded.close()
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Stellar Array simulator and visualizer engine")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[15, 45], help="square grid sizes")
+    parser.add_argument("--batches", nargs="+", type=int, default=[1, 64, 512], help="grids per call")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1946)
+    parser.add_argument("--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a stored results file")
+    parser.add_argument("--tolerance", type=float, default=0.20,
+                        help="allowed fractional slowdown before flagging (default 0.20)")
+    parser.add_argument("--check", action="store_true",
+                        help="only check that the threads backend matches serial results")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = check_backends(args.seed)
+        for mode in failures:
+            print(f"MISMATCH {mode}: threads backend differs from serial", file=sys.stderr)
+        return 1 if failures else 0
+    report = run_suite(args.modes, args.sizes, args.batches, args.repeats, args.seed)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+        for item in report["regressions"]:
+            print(f"REGRESSION {item['case']} {item['metric']}: "
+                  f"{item['baseline']:.4g} -> {item['current']:.4g} ({item['change']:+.1%})", file=sys.stderr)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+import argparse
+import array
+import asyncio
+import json
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from StellarArray import KERNELS, NullSink, Record, StellarArray
+
+# JSON-lines protocol, one object per line in each direction:
+#   request   {"id": 7, "mode": "trading", "tape": [..cells values..]}
+#   response  {"id": 7, "result": [[row, col, value], ...], "time_delay": 52.1}
+#             {"id": 7, "error": "message"}
+# AEC/CEA results are a single [null, null, value] record. {"id": 8, "op": "stats"}
+# returns the service counters. Responses come back in completion order, so
+# clients match them by id. Any mode in StellarArray.KERNELS is accepted,
+# including ones added with register_kernel.
+
+
+def encode_result(result):
+    if isinstance(result, Record):
+        return list(result)
+    return [list(record) for record in result]
+
+
+class SimulationService:
+    # One machine behind a bounded request queue. Requests that arrive within
+    # `window` seconds of each other (up to max_batch) run as one simulate_batch
+    # call per mode. The serial backend runs batches on the event loop itself:
+    # a worker thread would fight the loop for the GIL on every socket call.
+    # Pool backends wait on a worker thread while their pool does the work.
+    def __init__(self, rows=15, cols=15, stripes=3, window=0.002, max_batch=512, queue_size=2048,
+                 backend="serial", workers=None):
+        self.machine = StellarArray(rows, cols, stripes, backend=backend, workers=workers, sink=NullSink())
+        self.window = window
+        self.max_batch = max_batch
+        self.queue_size = queue_size
+        self.queue = None
+        self.executor = ThreadPoolExecutor(max_workers=1) if backend != "serial" else None
+        self.stats = {"requests": 0, "errors": 0, "batches": 0, "largest_batch": 0}
+        self.connections = {}  # Handler task -> writer of every open connection
+
+    def validate(self, request):
+        # (mode, tape as array('H')): the conversion rejects anything a register cannot hold
+        mode, tape = request.get("mode"), request.get("tape")
+        if mode not in KERNELS:
+            raise ValueError(f"Unknown mode {mode!r}")
+        if not isinstance(tape, list) or len(tape) != self.machine.cells:
+            raise ValueError(f"Tape must be a list of {self.machine.cells} values")
+        try:
+            return mode, array.array("H", tape)
+        except (TypeError, OverflowError):
+            raise ValueError("Tape values must be integers 0-65535") from None
+
+    async def submit(self, mode, tape):
+        # In-process entry point: (result, time_delay) once the request's batch has run.
+        # Waits for queue space first (backpressure).
+        mode, tape = self.validate({"mode": mode, "tape": list(tape)})
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((mode, tape, future))
+        return await future
+
+    async def _batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[0], []).append(item)
+            for mode, items in groups.items():
+                await self._run_group(loop, mode, items)
+            self.stats["batches"] += 1
+            self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+
+    async def _run_group(self, loop, mode, items):
+        tapes = array.array("H")  # One flat tape: the batch path splits it per grid
+        for _, tape, _ in items:
+            tapes.extend(tape)
+        try:
+            if self.executor is None:
+                results, delays = self.machine.simulate_batch(tapes, mode)
+            else:
+                results, delays = await loop.run_in_executor(self.executor, self.machine.simulate_batch, tapes, mode)
+        except Exception as exc:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, _, future), result, delay in zip(items, results, delays):
+            if not future.done():  # The client may have gone away
+                future.set_result((result, delay))
+
+    async def _respond(self, request_id, awaitable, writer, lock):
+        try:
+            result, delay = await awaitable
+            response = {"id": request_id, "result": encode_result(result), "time_delay": delay}
+        except Exception as exc:
+            self.stats["errors"] += 1
+            response = {"id": request_id, "error": str(exc)}
+        await self._write(writer, lock, response)
+
+    async def _write(self, writer, lock, response):
+        async with lock:
+            writer.write(json.dumps(response).encode() + b"\n")
+            await writer.drain()
+
+    async def handle(self, reader, writer):
+        # Per connection: read requests, queue them, answer as batches complete.
+        # Queueing blocks while the service is saturated, so a fast producer stops
+        # being read instead of growing memory.
+        lock = asyncio.Lock()
+        pending = set()
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request_id = None
+                try:
+                    request = json.loads(line)
+                    request_id = request.get("id")
+                    if request.get("op") == "stats":
+                        await self._write(writer, lock, {"id": request_id, "stats": dict(self.stats,
+                                                         queued=self.queue.qsize())})
+                        continue
+                    mode, tape = self.validate(request)
+                except (ValueError, AttributeError) as exc:
+                    self.stats["errors"] += 1
+                    await self._write(writer, lock, {"id": request_id, "error": str(exc)})
+                    continue
+                self.stats["requests"] += 1
+                future = asyncio.get_running_loop().create_future()
+                await self.queue.put((mode, tape, future))
+                task = asyncio.ensure_future(self._respond(request_id, future, writer, lock))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        except (ConnectionError, asyncio.CancelledError):  # Cancelled by close(): end quietly
+            pass
+        finally:
+            self.connections.pop(task, None)
+            for waiting in pending:
+                waiting.cancel()
+            writer.close()
+
+    async def start(self, host="127.0.0.1", port=8946):
+        self.queue = asyncio.Queue(self.queue_size)
+        self._batch_task = asyncio.ensure_future(self._batcher())
+        self.server = await asyncio.start_server(self.handle, host, port, limit=1 << 24)
+        return self.server
+
+    async def close(self):
+        # Stop accepting, drop the open connections, then wait for their handlers
+        # and the batcher to finish cancelling
+        self.server.close()
+        tasks = list(self.connections) + [self._batch_task]
+        for task, writer in list(self.connections.items()):
+            writer.close()
+            task.cancel()
+        self._batch_task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown()
+        self.machine.close()
+
+    @property
+    def port(self):
+        return self.server.sockets[0].getsockname()[1]
+
+
+class StellarArrayClient:
+    # Pipelining client: any number of simulate() calls may be in flight on one connection
+    def __init__(self):
+        self.next_id = 0
+        self.waiting = {}
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=8946):
+        client = cls()
+        client.reader, client.writer = await asyncio.open_connection(host, port, limit=1 << 24)
+        client._listener = asyncio.ensure_future(client._listen())
+        return client
+
+    async def _listen(self):
+        try:
+            while True:
+                line = await self.reader.readline()
+                if not line:
+                    break
+                response = json.loads(line)
+                future = self.waiting.pop(response.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            for future in self.waiting.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Service closed the connection"))
+
+    async def request(self, payload):
+        self.next_id += 1
+        payload["id"] = self.next_id
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[self.next_id] = future
+        self.writer.write(json.dumps(payload).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def simulate(self, mode, tape):
+        # (result records, time_delay); raises ValueError on a service error
+        response = await self.request({"mode": mode, "tape": list(tape)})
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["result"], response["time_delay"]
+
+    async def stats(self):
+        return (await self.request({"op": "stats"}))["stats"]
+
+    async def close(self):
+        self.writer.close()
+        self._listener.cancel()
+
+
+async def load_test(host, port, clients=32, requests=200, mode="trading", cells=225, seed=1946):
+    # Concurrent producers against a running service: throughput and latency percentiles
+    rng = random.Random(seed)
+    tapes = [[rng.randint(0, 10) for _ in range(cells)] for _ in range(64)]
+    latencies = []
+
+    async def producer(n):
+        client = await StellarArrayClient.connect(host, port)
+        for k in range(requests):
+            start = time.perf_counter()
+            await client.simulate(mode, tapes[(n + k) % len(tapes)])
+            latencies.append(time.perf_counter() - start)
+        await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(producer(n) for n in range(clients)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+    return {"requests": len(latencies), "requests_per_s": len(latencies) / elapsed,
+            "p50_ms": pick(0.50), "p99_ms": pick(0.99)}
+
+
+def _run_load_test(*args):
+    # Producers run in their own process so they do not share the service's event loop
+    return asyncio.run(load_test(*args))
+
+
+async def _serve(args):
+    service = SimulationService(args.rows, args.cols, args.stripes, window=args.window / 1000,
+                                max_batch=args.max_batch, queue_size=args.queue_size,
+                                backend=args.backend, workers=args.workers)
+    await service.start(args.host, args.port)
+    print(f"Stellar Array service on {args.host}:{service.port}", file=sys.stderr)
+    if args.load_test:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            report = await asyncio.get_running_loop().run_in_executor(
+                pool, _run_load_test, args.host, service.port, args.clients, args.load_test, "trading",
+                service.machine.cells)
+        print(json.dumps(report, indent=2))
+        await service.close()
+        return
+    async with service.server:
+        await service.server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve Stellar Array simulations over JSON lines")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8946)
+    parser.add_argument("--rows", type=int, default=15)
+    parser.add_argument("--cols", type=int, default=15)
+    parser.add_argument("--stripes", type=int, default=3)
+    parser.add_argument("--window", type=float, default=2.0, help="micro-batch window in ms (default 2)")
+    parser.add_argument("--max-batch", type=int, default=512)
+    parser.add_argument("--queue-size", type=int, default=2048, help="queued requests before producers block")
+    parser.add_argument("--backend", default="serial", choices=("serial", "threads", "processes"))
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--load-test", type=int, metavar="N",
+                        help="start on a free port, run N requests per client against it, then exit")
+    parser.add_argument("--clients", type=int, default=32)
+    args = parser.parse_args(argv)
+    if args.load_test:
+        args.port = 0
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
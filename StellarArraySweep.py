@@ -0,0 +1,464 @@
+import argparse
+import array
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from StellarArray import BACKENDS, NullSink, StellarArray
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; chunks fall back to plain loops
+    np = None
+
+# Monte Carlo reliability sweeps. A trial draws a clean tape, adds tape noise,
+# burns out tubes and runs the mode on what the calculators latch, then scores the
+# result against the clean tape. Trials run in chunks: one vectorized pass per
+# chunk with NumPy, a tight loop without it. A chunk comes back as merged metric
+# distributions, never as per-trial results, so memory does not grow with the
+# number of trials.
+SweepPoint = namedtuple("SweepPoint", "burnout threshold noise")
+MODES = ("trading", "aec", "cea")
+# Clean tape values per mode, as in the StellarArray.py demo
+VALUE_RANGES = {"aec": (0, 10), "cea": (20, 80), "trading": (0, 10)}
+TUBES_PER_REGISTER = 4  # A register needs all of its tubes; a calculator's other tubes are control
+METRICS = {
+    # signals: trades the machine reports; missed/false: against the clean tape at the reference threshold
+    "trading": ("signals", "missed", "false", "dead_registers", "dead_stripes", "outage"),
+    # value: the reported k / criticality; error: value minus the clean tape's
+    "aec": ("value", "error", "dead_registers", "dead_stripes", "outage"),
+    "cea": ("value", "error", "dead_registers", "dead_stripes", "outage"),
+}
+
+
+class Distribution:
+    # Streaming summary of one metric: count, mean and M2 (chunks merged with the
+    # parallel Welford update), min, max and a fixed-bin histogram for quantiles
+    __slots__ = ("low", "width", "bins", "integer", "count", "mean", "m2", "min", "max", "histogram")
+
+    def __init__(self, low, high, bins=64, integer=False):
+        span = max(high - low, 1)
+        self.low = low
+        self.width = math.ceil(span / bins) if integer else span / bins
+        self.bins = math.ceil(span / self.width)
+        self.integer = integer
+        self.count = 0
+        self.mean = self.m2 = 0.0
+        self.min, self.max = math.inf, -math.inf
+        self.histogram = array.array("q", bytes(8 * self.bins))
+
+    def _merge(self, count, mean, m2, low, high):
+        if not count:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+        self.min = min(self.min, x)
+        self.max = max(self.max, x)
+        self.histogram[min(self.bins - 1, max(0, int((x - self.low) // self.width)))] += 1
+
+    def add_many(self, values):
+        # A whole chunk: NumPy arrays are summarized in C and merged in one update
+        if np is None or not isinstance(values, np.ndarray):
+            for x in values:
+                self.add(x)
+            return
+        if not values.size:
+            return
+        mean = float(values.mean())
+        self._merge(values.size, mean, float(((values - mean) ** 2).sum()), values.min().item(), values.max().item())
+        slots = np.clip((values - self.low) // self.width, 0, self.bins - 1).astype(np.intp)
+        for b, n in enumerate(np.bincount(slots, minlength=self.bins).tolist()):
+            self.histogram[b] += n
+
+    def merge(self, other):
+        self._merge(other.count, other.mean, other.m2, other.min, other.max)
+        for b, n in enumerate(other.histogram):
+            self.histogram[b] += n
+
+    @property
+    def variance(self):
+        # Population variance (0 before the first value)
+        return self.m2 / self.count if self.count else 0.0
+
+    def quantile(self, q):
+        # Approximate quantile from the histogram bin holding it: its middle, or its
+        # first value for integer metrics
+        if not self.count:
+            return math.nan
+        rank = q * self.count
+        seen = 0
+        for b, n in enumerate(self.histogram):
+            seen += n
+            if seen >= rank and n:
+                offset = 0 if self.integer else 0.5 * self.width
+                return min(self.max, max(self.min, self.low + b * self.width + offset))
+        return self.max
+
+    def summary(self):
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "mean": self.mean, "std": math.sqrt(self.variance), "min": self.min,
+                "max": self.max, "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+Layout = namedtuple("Layout", "cells stripes registers cell_stripe cell_register control aggregator_control")
+_LAYOUTS = {}  # Per process: geometry -> Layout
+
+
+def _layout(geometry):
+    # Which stripe and register latch each cell, and each calculator's control tubes.
+    # The cells come from the machine's own dead_cells() with each tube burnt out.
+    layout = _LAYOUTS.get(geometry)
+    if layout is None:
+        rows, cols, stripes, registers = geometry
+        machine = StellarArray(rows, cols, stripes, registers, sink=NullSink())
+        cells = machine.cells
+        cell_stripe, cell_register = [0] * cells, [0] * cells
+        for s in range(stripes):
+            machine.burn_out(s)
+            for c in machine.dead_cells():
+                cell_stripe[c] = s
+            machine.repair()
+            for r in range(registers):
+                machine.burn_out(s, r)
+                for c in machine.dead_cells():
+                    cell_register[c] = r
+                machine.repair()
+        layout = _LAYOUTS[geometry] = Layout(
+            cells, stripes, registers, cell_stripe, cell_register,
+            max(0, machine.calculators[0].tubes - TUBES_PER_REGISTER * registers),
+            max(0, machine.aggregator.tubes - TUBES_PER_REGISTER * registers))
+    return layout
+
+
+def _failure_odds(layout, burnout):
+    # Per run: P(register dead), P(stripe control dead), P(aggregator down) when
+    # every tube burns out independently with probability burnout
+    alive = 1.0 - burnout
+    return (1.0 - alive ** TUBES_PER_REGISTER, 1.0 - alive ** layout.control,
+            1.0 - alive ** layout.aggregator_control)
+
+
+def new_stats(geometry, mode, values, noise, bins=64):
+    # Empty distributions for a sweep point's metrics
+    layout = _layout(geometry)
+    low, high = values
+    top = high + noise
+    ranges = {"signals": (0, layout.cells + 1), "missed": (0, layout.cells + 1), "false": (0, layout.cells + 1),
+              "dead_registers": (0, layout.stripes * layout.registers + 1), "dead_stripes": (0, layout.stripes + 1),
+              "outage": (0, 2)}
+    stats = {}
+    for metric in METRICS[mode]:
+        if metric == "value":
+            stats[metric] = Distribution(0, top, bins)
+        elif metric == "error":
+            stats[metric] = Distribution(-top, top, bins)
+        else:
+            stats[metric] = Distribution(*ranges[metric], bins=bins, integer=True)
+    return stats
+
+
+def _trials_numpy(rng, layout, mode, point, values, reference, trials, stats):
+    low, high = values
+    clean = rng.integers(low, high + 1, size=(trials, layout.cells))
+    observed = clean
+    if point.noise:
+        observed = np.clip(clean + rng.integers(-point.noise, point.noise + 1, size=clean.shape), 0, 0xFFFF)
+    outage = np.zeros(trials, dtype=bool)
+    if point.burnout:
+        register_odds, stripe_odds, aggregator_odds = _failure_odds(layout, point.burnout)
+        registers = rng.random((trials, layout.stripes, layout.registers)) < register_odds
+        stripes = rng.random((trials, layout.stripes)) < stripe_odds
+        outage = rng.random(trials) < aggregator_odds
+        dead = registers[:, layout.cell_stripe, layout.cell_register] | stripes[:, layout.cell_stripe]
+        observed = np.where(dead, 0, observed)
+        stats["dead_registers"].add_many(registers.sum(axis=(1, 2)))
+        stats["dead_stripes"].add_many(stripes.sum(axis=1))
+    else:
+        stats["dead_registers"].add_many(np.zeros(trials, dtype=np.int64))
+        stats["dead_stripes"].add_many(np.zeros(trials, dtype=np.int64))
+    stats["outage"].add_many(outage.astype(np.int64))
+    if mode == "trading":
+        fired = observed > point.threshold
+        fired[outage] = False  # Calculator 3 is down: nothing reaches the output
+        truth = clean > reference
+        stats["signals"].add_many(fired.sum(axis=1))
+        stats["missed"].add_many((truth & ~fired).sum(axis=1))
+        stats["false"].add_many((fired & ~truth).sum(axis=1))
+    else:
+        up = ~outage
+        value = observed[up].mean(axis=1)
+        stats["value"].add_many(value)
+        stats["error"].add_many(value - clean[up].mean(axis=1))
+
+
+def _draw_trial(rng, layout, point, tape_values, jitter, odds):
+    # One plain-loop trial: (clean tape, tape as read, what the calculators latch,
+    # dead registers per stripe, stripes down, aggregator outage)
+    cells, stripes, nregs = layout.cells, layout.stripes, layout.registers
+    clean = rng.choices(tape_values, k=cells)
+    read = clean
+    if point.noise:
+        read = [min(0xFFFF, max(0, v + e)) for v, e in zip(clean, rng.choices(jitter, k=cells))]
+    observed = read
+    registers, down, outage = [[False] * nregs for _ in range(stripes)], [False] * stripes, False
+    if point.burnout:
+        register_odds, stripe_odds, aggregator_odds = odds
+        random_ = rng.random
+        registers = [[random_() < register_odds for _ in range(nregs)] for _ in range(stripes)]
+        down = [random_() < stripe_odds for _ in range(stripes)]
+        outage = random_() < aggregator_odds
+        if any(down) or any(map(any, registers)):
+            observed = [0 if down[s] or registers[s][r] else v
+                        for v, s, r in zip(read, layout.cell_stripe, layout.cell_register)]
+    return clean, read, observed, registers, down, outage
+
+
+def _trials_python(rng, layout, mode, point, values, reference, trials, stats):
+    low, high = values
+    cells = layout.cells
+    tape_values = range(low, high + 1)
+    jitter = range(-point.noise, point.noise + 1)
+    odds = _failure_odds(layout, point.burnout) if point.burnout else None
+    add = {metric: distribution.add for metric, distribution in stats.items()}
+    for _ in range(trials):
+        clean, _, observed, registers, down, outage = _draw_trial(rng, layout, point, tape_values, jitter, odds)
+        dead_registers = sum(map(sum, registers))
+        dead_stripes = sum(down)
+        add["dead_registers"](dead_registers)
+        add["dead_stripes"](dead_stripes)
+        add["outage"](int(outage))
+        if mode == "trading":
+            threshold = point.threshold
+            signals = missed = false = 0
+            if not outage:
+                for v, c in zip(observed, clean):
+                    fired, truth = v > threshold, c > reference
+                    signals += fired
+                    missed += truth and not fired
+                    false += fired and not truth
+            else:
+                missed = sum(c > reference for c in clean)
+            add["signals"](signals)
+            add["missed"](missed)
+            add["false"](false)
+        elif not outage:
+            value = sum(observed) / cells
+            add["value"](value)
+            add["error"](value - sum(clean) / cells)
+
+
+def run_chunk(task):
+    # One chunk of trials at one sweep point: (point index, chunk index, trials, stats).
+    # Each chunk seeds its own stream from (seed, point, chunk), so results do not
+    # depend on which worker runs it or how many workers there are.
+    geometry, mode, values, reference, bins, point, index, chunk, trials, seed = task
+    layout = _layout(geometry)
+    stats = new_stats(geometry, mode, values, point.noise, bins)
+    if np is not None:
+        _trials_numpy(np.random.default_rng([seed, index, chunk]), layout, mode, point, values, reference,
+                      trials, stats)
+    else:
+        _trials_python(random.Random(f"{seed}:{index}:{chunk}"), layout, mode, point, values, reference,
+                       trials, stats)
+    return index, chunk, trials, stats
+
+
+def check_trials(geometry=(15, 15, 3, 38), mode="trading", point=SweepPoint(0.02, 5, 2), count=20, seed=1946,
+                 values=None):
+    # Fixed-seed plain-loop trials against the machine itself: the tape as read,
+    # run by StellarArray.simulate with the trial's tubes burnt out, must give the
+    # trial's signals (or value). Aggregator outages are not modelled by the machine
+    # and are left out. Returns the trial numbers that differ.
+    layout = _layout(geometry)
+    low, high = values or VALUE_RANGES[mode]
+    rng = random.Random(seed)
+    odds = _failure_odds(layout, point.burnout) if point.burnout else None
+    threshold = point.threshold if point.threshold is not None else 5
+    cols = geometry[1]
+    mismatched = []
+    for trial in range(count):
+        _, read, observed, registers, down, _ = _draw_trial(rng, layout, point, range(low, high + 1),
+                                                             range(-point.noise, point.noise + 1), odds)
+        machine = StellarArray(*geometry, sink=NullSink(), rules={"trading": threshold})
+        for s, dead in enumerate(registers):
+            for r in (r for r, burnt in enumerate(dead) if burnt):
+                machine.burn_out(s, r)
+            if down[s]:
+                machine.burn_out(s)
+        result = machine.simulate(read, mode)
+        if mode == "trading":
+            same = [r.row * cols + r.col for r in result] == [c for c, v in enumerate(observed) if v > threshold]
+        else:
+            same = result.value == sum(observed) / layout.cells
+        if not same:
+            mismatched.append(trial)
+    return mismatched
+
+
+class MonteCarloSweep:
+    # Every combination of burnout rate (per tube, per run), trading threshold and
+    # tape noise (uniform +/- integer) is a sweep point that runs `trials` trials
+    # in chunks on a worker pool. results[point] holds the metric distributions
+    # merged so far. Chunks are merged in order, so a given seed reproduces the
+    # same numbers with any number of workers.
+    def __init__(self, rows=15, cols=15, stripes=3, registers=38, mode="trading", burnout=(0.0,), thresholds=(5,),
+                 noise=(0,), trials=10000, seed=1946, reference=5, values=None, backend="processes", workers=None,
+                 chunk=2048, bins=64):
+        if mode not in MODES:
+            raise ValueError(f"Sweeps support {', '.join(MODES)}")
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend '{backend}'")
+        if any(not 0 <= p <= 1 for p in burnout):
+            raise ValueError("Burnout rates are probabilities (0-1)")
+        if any(n < 0 for n in noise):
+            raise ValueError("Tape noise must be non-negative")
+        self.geometry = (rows, cols, stripes, registers)
+        self.mode = mode
+        self.values = tuple(values or VALUE_RANGES[mode])
+        self.reference = reference
+        self.trials = trials
+        self.seed = seed
+        self.bins = bins
+        self.backend = backend
+        self.workers = workers or os.cpu_count() or 1
+        # Keep a chunk's tapes to a few million values whatever the grid size
+        self.chunk = max(1, min(chunk, (1 << 22) // (rows * cols)))
+        self.points = [SweepPoint(p, t, n) for p in burnout for t in (thresholds if mode == "trading" else (None,))
+                       for n in noise]
+        self.results = {point: new_stats(self.geometry, mode, self.values, point.noise, bins) for point in self.points}
+        self.completed = dict.fromkeys(self.points, 0)
+        self._next = [0] * len(self.points)  # Next chunk to merge, per point
+        self._early = [{} for _ in self.points]  # Chunks that finished ahead of it
+
+    def tasks(self):
+        for index, point in enumerate(self.points):
+            for chunk, start in enumerate(range(0, self.trials, self.chunk)):
+                yield (self.geometry, self.mode, self.values, self.reference, self.bins, point, index, chunk,
+                       min(self.chunk, self.trials - start), self.seed)
+
+    def _merge(self, done):
+        index, chunk, trials, stats = done
+        early = self._early[index]
+        early[chunk] = (trials, stats)
+        point = self.points[index]
+        while self._next[index] in early:
+            trials, stats = early.pop(self._next[index])
+            for metric, distribution in stats.items():
+                self.results[point][metric].merge(distribution)
+            self.completed[point] += trials
+            self._next[index] += 1
+        return point, self.completed[point]
+
+    def stream(self):
+        # Yields (point, trials merged at that point) as chunks complete. Only a
+        # couple of chunks per worker are in flight, so a sweep of any size runs
+        # in constant memory.
+        if self.backend == "serial":
+            for task in self.tasks():
+                yield self._merge(run_chunk(task))
+            return
+        executor_type = ProcessPoolExecutor if self.backend == "processes" else ThreadPoolExecutor
+        with executor_type(max_workers=self.workers) as executor:
+            pending = set()
+            for task in self.tasks():
+                pending.add(executor.submit(run_chunk, task))
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield self._merge(future.result())
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield self._merge(future.result())
+
+    def run(self):
+        for _ in self.stream():
+            pass
+        return self.results
+
+    def summary(self):
+        # One row per sweep point: its parameters, trial count and metric summaries
+        return [dict(point._asdict(), trials=self.completed[point],
+                     **{metric: distribution.summary() for metric, distribution in self.results[point].items()})
+                for point in self.points]
+
+
+def format_summary(rows, mode):
+    columns = METRICS[mode][:2] + ("outage",)
+    lines = [f"{'burnout':>9} {'thresh':>6} {'noise':>5} {'trials':>9} " +
+             " ".join(f"{c + ' mean':>13} {c + ' p99':>11}" for c in columns)]
+    for row in rows:
+        threshold = "-" if row["threshold"] is None else row["threshold"]
+        cells = []
+        for c in columns:
+            stats = row[c]
+            cells.append(f"{stats.get('mean', math.nan):>13.4f} {stats.get('p99', math.nan):>11.2f}")
+        lines.append(f"{row['burnout']:>9.2g} {threshold:>6} {row['noise']:>5} {row['trials']:>9} " + " ".join(cells))
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo tube-failure and threshold sweeps")
+    parser.add_argument("--mode", default="trading", choices=MODES)
+    parser.add_argument("--rows", type=int, default=15)
+    parser.add_argument("--cols", type=int, default=15)
+    parser.add_argument("--stripes", type=int, default=3)
+    parser.add_argument("--registers", type=int, default=38)
+    parser.add_argument("--burnout", type=float, nargs="+", default=[0.0, 1e-4, 1e-3, 1e-2],
+                        help="per-tube burnout probability per run")
+    parser.add_argument("--thresholds", type=int, nargs="+", default=[5])
+    parser.add_argument("--noise", type=int, nargs="+", default=[0], help="tape noise, +/- this many units")
+    parser.add_argument("--trials", type=int, default=100000, help="trials per sweep point")
+    parser.add_argument("--seed", type=int, default=1946)
+    parser.add_argument("--backend", default="processes", choices=BACKENDS)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk", type=int, default=2048, help="trials per task")
+    parser.add_argument("--output", help="write the summaries as JSON")
+    parser.add_argument("--check", action="store_true",
+                        help="only check fixed-seed trials against StellarArray.simulate with the same failures")
+    args = parser.parse_args(argv)
+    if args.check:
+        geometry = (args.rows, args.cols, args.stripes, args.registers)
+        point = SweepPoint(max(args.burnout) or 0.02, args.thresholds[0] if args.mode == "trading" else None,
+                           args.noise[0])
+        mismatched = check_trials(geometry, args.mode, point, seed=args.seed)
+        for trial in mismatched:
+            print(f"MISMATCH trial {trial}: the sweep model differs from the machine", file=sys.stderr)
+        return 1 if mismatched else 0
+    sweep = MonteCarloSweep(args.rows, args.cols, args.stripes, args.registers, args.mode, args.burnout,
+                            args.thresholds, args.noise, args.trials, args.seed, backend=args.backend,
+                            workers=args.workers, chunk=args.chunk)
+    start = time.perf_counter()
+    total = len(sweep.points) * args.trials
+    merged = 0
+    for _ in sweep.stream():
+        merged = sum(sweep.completed.values())
+        print(f"\r{merged}/{total} trials", end="", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    print(f"\r{merged} trials in {elapsed:.1f} s ({merged / elapsed:,.0f} trials/s)", file=sys.stderr)
+    rows = sweep.summary()
+    print(format_summary(rows, args.mode))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
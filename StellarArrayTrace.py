@@ -0,0 +1,472 @@
+import argparse
+import array
+import mmap
+import os
+import struct
+import sys
+
+# Trace file layout (little-endian):
+#   header   "SATR" u16 version, u16 keyframe_every, u16 rows, u16 cols, u16 stripes,
+#            u16 registers, then the mode as a length-prefixed string
+#   records  u8 kind, u32 payload length, payload
+#            STEP:     u16 delta count, deltas drawn during one engine step
+#            KEYFRAME: u32 step, then the state after `step` steps: a string table,
+#                      u32 string ids (fill, text, text colour) per grid cell, an i8
+#                      lit flag and an i64 value per register, the output log, and
+#                      u16 count plus the last call for every other widget
+#   index    u64 offset per keyframe, then footer "SAIX" u32 keyframes, u32 steps, u64 index offset
+# A delta is u8 method id, u8 argument count, then each argument as a tagged value.
+TRACE_MAGIC = b"SATR"
+INDEX_MAGIC = b"SAIX"
+TRACE_VERSION = 2
+HEADER = struct.Struct("<4sHHHHHH")
+RECORD = struct.Struct("<BI")
+FOOTER = struct.Struct("<4sIIQ")
+STEP, KEYFRAME = 0, 1
+NO_CELL = 0xFFFFFFFF  # Grid cell not drawn since the layout
+NO_REGISTER = -1  # Register not drawn since the last reset
+
+# Drawing methods the engine calls on the visualizer, by method id
+TRACE_METHODS = ("log", "set_status", "update_output_display", "update_tape_display", "highlight_tape",
+                 "highlight_calculator", "highlight_register", "update_calc_header", "update_grid_cell",
+                 "highlight_aggregator", "update_aggregator_status", "reset_visuals", "draw_grid_layout")
+METHOD_IDS = {name: i for i, name in enumerate(TRACE_METHODS)}
+
+# Drawing calls that target one widget, keyed by their leading arguments so that
+# only the latest call per widget survives a frame
+DELTA_KEYS = {"highlight_calculator": 1, "highlight_register": 2, "update_calc_header": 1,
+              "update_grid_cell": 2}
+
+
+class FrameCoalescer:
+    # Collapses a run of (method, args) deltas to the last call per widget. Later
+    # calls move to the end, so replaying the survivors in order gives the same
+    # picture as replaying every delta.
+    def __init__(self):
+        self.pending = {}
+
+    def add(self, name, args):
+        key = (name,) + args[:DELTA_KEYS.get(name, 0)]
+        self.pending.pop(key, None)
+        self.pending[key] = (name, args)
+
+    def drain(self):
+        deltas = list(self.pending.values())
+        self.pending.clear()
+        return deltas
+
+
+# --- VALUE ENCODING ---
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_LEN = struct.Struct("<I")
+
+
+def _pack(value, out):
+    if value is None:
+        out += b"N"
+    elif value is True or value is False:
+        out += b"T" if value else b"F"
+    elif isinstance(value, int):
+        out += b"i" + _INT.pack(value)
+    elif isinstance(value, float):
+        out += b"f" + _FLOAT.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += b"s" + _LEN.pack(len(data)) + data
+    elif isinstance(value, (list, tuple)):
+        out += b"l" + _LEN.pack(len(value))
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, dict):
+        out += b"d" + _LEN.pack(len(value))
+        for key, item in value.items():
+            _pack(key, out)
+            _pack(item, out)
+    else:
+        raise TypeError(f"Cannot trace a {type(value).__name__} argument")
+
+
+def _unpack(buf, pos):
+    tag = buf[pos]
+    pos += 1
+    if tag == 0x4E:  # N
+        return None, pos
+    if tag == 0x54:  # T
+        return True, pos
+    if tag == 0x46:  # F
+        return False, pos
+    if tag == 0x69:  # i
+        return _INT.unpack_from(buf, pos)[0], pos + 8
+    if tag == 0x66:  # f
+        return _FLOAT.unpack_from(buf, pos)[0], pos + 8
+    n = _LEN.unpack_from(buf, pos)[0]
+    pos += 4
+    if tag == 0x73:  # s
+        return str(buf[pos:pos + n], "utf-8"), pos + n
+    if tag == 0x6C:  # l
+        items = []
+        for _ in range(n):
+            item, pos = _unpack(buf, pos)
+            items.append(item)
+        return items, pos
+    if tag == 0x64:  # d
+        items = {}
+        for _ in range(n):
+            key, pos = _unpack(buf, pos)
+            items[key], pos = _unpack(buf, pos)
+        return items, pos
+    raise ValueError(f"Corrupt trace value tag {tag:#x} at byte {pos - 5}")
+
+
+def _pack_deltas(deltas, out):
+    for name, args in deltas:
+        try:
+            out += bytes((METHOD_IDS[name], len(args)))
+        except KeyError:
+            raise ValueError(f"Unknown drawing method {name!r}") from None
+        for arg in args:
+            _pack(arg, out)
+
+
+def _unpack_deltas(buf, pos, count):
+    deltas = []
+    for _ in range(count):
+        name, argc = TRACE_METHODS[buf[pos]], buf[pos + 1]
+        pos += 2
+        args = []
+        for _ in range(argc):
+            arg, pos = _unpack(buf, pos)
+            args.append(arg)
+        deltas.append((name, tuple(args)))
+    return deltas, pos
+
+
+def _pack_state(state, rows, cols, stripes, registers, out):
+    # Grid cell strings go through one table, since most cells share their colours
+    strings, ids = [], {}
+
+    def intern(value):
+        if value not in ids:
+            ids[value] = len(strings)
+            strings.append(value)
+        return ids[value]
+    cells = array.array("I", [NO_CELL]) * (3 * rows * cols)
+    for (row, col), cell in state.grid.items():
+        at = 3 * (row * cols + col)
+        cells[at:at + 3] = array.array("I", [intern(item) for item in cell])
+    lit = array.array("b", [NO_REGISTER]) * (stripes * registers)
+    values = array.array("q", bytes(8 * stripes * registers))
+    for (calc_id, reg_id), (on, val) in state.registers.items():
+        at = calc_id * registers + reg_id
+        lit[at], values[at] = bool(on), val
+    out += struct.pack("<I", state.step)
+    _pack(strings, out)
+    out += cells.tobytes() + lit.tobytes() + values.tobytes()
+    _pack(state.output_log, out)
+    widgets = list(state.widgets.pending.values())
+    out += struct.pack("<H", len(widgets))
+    _pack_deltas(widgets, out)
+
+
+def _unpack_state(buf, pos, rows, cols, stripes, registers):
+    state = TraceState(struct.unpack_from("<I", buf, pos)[0])
+    strings, pos = _unpack(buf, pos + 4)
+    cells = array.array("I", buf[pos:pos + 12 * rows * cols])
+    pos += 12 * rows * cols
+    count = stripes * registers
+    lit = array.array("b", buf[pos:pos + count])
+    values = array.array("q", buf[pos + count:pos + 9 * count])
+    pos += 9 * count
+    for at in range(0, len(cells), 3):
+        if cells[at] != NO_CELL:
+            state.grid[divmod(at // 3, cols)] = tuple(strings[i] for i in cells[at:at + 3])
+    for at, on in enumerate(lit):
+        if on != NO_REGISTER:
+            state.registers[divmod(at, registers)] = (bool(on), values[at])
+    state.output_log, pos = _unpack(buf, pos)
+    count = struct.unpack_from("<H", buf, pos)[0]
+    for name, args in _unpack_deltas(buf, pos + 2, count)[0]:
+        state.widgets.add(name, args)
+    return state
+
+
+# --- RECORDING ---
+class TraceWriter:
+    # Appends one STEP record per engine step and a KEYFRAME every
+    # `keyframe_every` steps, so any step is at most that many records from a keyframe
+    def __init__(self, path, mode, machine, keyframe_every=64):
+        if not 0 < keyframe_every < 1 << 16:
+            raise ValueError("keyframe_every must be between 1 and 65535")
+        self.file = open(path, "wb")
+        self.keyframe_every = keyframe_every
+        self.geometry = (machine.rows, machine.cols, machine.stripes, len(machine.calculators[0].registers))
+        self.state = TraceState()  # Cumulative picture for the keyframes
+        self.current = []
+        self.keyframes = array.array("Q")
+        self.steps = 0
+        header = bytearray(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, keyframe_every, *self.geometry))
+        _pack(mode, header)
+        self.file.write(header)
+        self._keyframe()
+
+    def record(self, name, args):
+        self.current.append((name, args))
+        self.state.apply(name, args)
+
+    def end_step(self):
+        payload = bytearray(struct.pack("<H", len(self.current)))
+        _pack_deltas(self.current, payload)
+        self.file.write(RECORD.pack(STEP, len(payload)))
+        self.file.write(payload)
+        self.current = []
+        self.steps += 1
+        if self.steps % self.keyframe_every == 0:
+            self._keyframe()
+
+    def _keyframe(self):
+        self.state.step = self.steps
+        payload = bytearray()
+        _pack_state(self.state, *self.geometry, payload)
+        self.keyframes.append(self.file.tell())
+        self.file.write(RECORD.pack(KEYFRAME, len(payload)))
+        self.file.write(payload)
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.current:  # Deltas drawn after the last full step
+            self.end_step()
+        index = self.file.tell()
+        self.file.write(self.keyframes.tobytes())
+        self.file.write(FOOTER.pack(INDEX_MAGIC, len(self.keyframes), self.steps, index))
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class TracingChannel:
+    # Stands in for the visualizer: records every drawing call and forwards it to
+    # `target` when one is given
+    def __init__(self, machine, writer, target=None):
+        self.machine = machine
+        self._writer = writer
+        self._target = target
+
+    def __getattr__(self, name):
+        forward = getattr(self._target, name) if self._target is not None else None
+
+        def delta(*args):
+            self._writer.record(name, args)
+            if forward is not None:
+                forward(*args)
+        return delta
+
+
+def record_run(path, mode="trading", machine=None, keyframe_every=64):
+    # Run a SimulationEngine headless to completion and write its trace
+    from StellarArrayVisualizer import SimulationEngine
+    from StellarArray import NullSink, StellarArray
+    machine = machine or StellarArray(sink=NullSink())
+    with TraceWriter(path, mode, machine, keyframe_every) as writer:
+        engine = SimulationEngine(mode, TracingChannel(machine, writer))
+        while not engine.is_complete:
+            engine.step()
+            writer.end_step()
+        return writer.steps
+
+
+# --- REPLAY ---
+class TraceState:
+    # The picture after some step, held as the grid memory, registers and output
+    # log it shows plus the last call for every other widget
+    def __init__(self, step=0):
+        self.step = step
+        self.grid = {}  # {(row, col): (fill, text, text_color)}
+        self.registers = {}  # {(calculator, register): (lit, value)}
+        self.output_log = []
+        self.widgets = FrameCoalescer()
+
+    def apply(self, name, args):
+        if name == "update_grid_cell":
+            row, col, fill, text = args[:4]
+            self.grid[(row, col)] = (fill, text, args[4] if len(args) > 4 else "white")
+        elif name == "highlight_register":
+            calc_id, reg_id, on, val = args
+            self.registers[(calc_id, reg_id)] = (on, val)
+        elif name == "update_output_display":
+            self.output_log = list(args[0])
+        elif name == "draw_grid_layout":
+            self.grid.clear()
+        elif name == "reset_visuals":  # Blanks the registers and unlights the calculators
+            self.registers.clear()
+            pending = self.widgets.pending
+            for key in [key for key in pending if key[0] == "highlight_calculator"]:
+                del pending[key]
+        else:
+            self.widgets.add(name, args)
+
+    @property
+    def deltas(self):
+        # Drawing calls that rebuild this picture on a blank display
+        calls = [("update_grid_cell", key + cell) for key, cell in self.grid.items()]
+        calls += [("highlight_register", key + reg) for key, reg in self.registers.items()]
+        calls.append(("update_output_display", (list(self.output_log),)))
+        calls += self.widgets.pending.values()
+        return calls
+
+    @property
+    def register_text(self):
+        # {(calculator, register): text} as the register labels show it
+        return {key: str(val) for key, (on, val) in self.registers.items()}
+
+    def _latest(self, name, default):
+        call = self.widgets.pending.get((name,))
+        return call[1][0] if call else default
+
+    @property
+    def log(self):
+        return self._latest("log", "")
+
+    @property
+    def status(self):
+        return self._latest("set_status", "")
+
+
+class TraceReader:
+    # Memory-maps a trace. seek(step) starts from the keyframe at or before
+    # `step` and applies at most keyframe_every step records.
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        if size < HEADER.size:
+            self.file.close()
+            raise ValueError("Not a Stellar Array trace")
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.keyframe_every, self.rows, self.cols,
+         self.stripes, self.registers) = HEADER.unpack_from(self.buf, 0)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            self.close()
+            raise ValueError("Not a Stellar Array trace (or unsupported version)")
+        self.mode, self.start = _unpack(self.buf, HEADER.size)
+        self._load_index(size)
+
+    def _load_index(self, size):
+        magic, count, steps, index = FOOTER.unpack_from(self.buf, size - FOOTER.size) \
+            if size >= HEADER.size + FOOTER.size else (None, 0, 0, 0)
+        if magic == INDEX_MAGIC:
+            self.keyframes = array.array("Q", self.buf[index:index + 8 * count])
+            self.steps, self.end = steps, index
+            return
+        # No footer (recording was cut short): rebuild the index with one scan
+        self.keyframes = array.array("Q")
+        self.steps, pos = 0, self.start
+        while pos + RECORD.size <= size:
+            kind, length = RECORD.unpack_from(self.buf, pos)
+            if pos + RECORD.size + length > size:
+                break
+            if kind == KEYFRAME:
+                self.keyframes.append(pos)
+            else:
+                self.steps += 1
+            pos += RECORD.size + length
+        self.end = pos
+
+    def _record(self, pos):
+        kind, length = RECORD.unpack_from(self.buf, pos)
+        return kind, pos + RECORD.size, pos + RECORD.size + length
+
+    def keyframe(self, step):
+        # (state, offset of the next record) for the keyframe at or before step
+        pos = self.keyframes[min(step // self.keyframe_every, len(self.keyframes) - 1)]
+        _, body, after = self._record(pos)
+        state = _unpack_state(self.buf, body, self.rows, self.cols, self.stripes, self.registers)
+        return state, after
+
+    def seek(self, step):
+        # The picture after `step` engine steps (0 is the blank start)
+        if not 0 <= step <= self.steps:
+            raise IndexError(f"Step {step} outside trace (0-{self.steps})")
+        state, pos = self.keyframe(step)
+        while state.step < step:
+            kind, body, pos = self._record(pos)
+            if kind == STEP:
+                for name, args in self._step_deltas(body):
+                    state.apply(name, args)
+                state.step += 1
+        return state
+
+    def _step_deltas(self, body):
+        count = struct.unpack_from("<H", self.buf, body)[0]
+        return _unpack_deltas(self.buf, body + 2, count)[0]
+
+    def __iter__(self):
+        # (step, deltas) for every step record, in order
+        step, pos = 0, self.start
+        while pos < self.end:
+            kind, body, pos = self._record(pos)
+            if kind == STEP:
+                step += 1
+                yield step, self._step_deltas(body)
+
+    def find(self, name, predicate=None):
+        # Steps whose deltas call `name` (and satisfy predicate(args)), e.g. the
+        # aggregator status changes that mark signal firings
+        for step, deltas in self:
+            if any(method == name and (predicate is None or predicate(args)) for method, args in deltas):
+                yield step
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def check(path):
+    # Seek to every step and compare the picture with a straight replay of the
+    # step records. Each register must also show the value it last latched.
+    # Returns the steps that differ.
+    mismatched = []
+    with TraceReader(path) as trace:
+        replay, latched = TraceState(), {}
+        for step, deltas in trace:
+            for name, args in deltas:
+                replay.apply(name, args)
+                if name == "highlight_register" and args[2]:
+                    latched[args[:2]] = str(args[3])
+                elif name == "reset_visuals":
+                    latched.clear()
+            state = trace.seek(step)
+            text = state.register_text
+            if (state.grid != replay.grid or text != replay.register_text or state.output_log != replay.output_log
+                    or any(text.get(key) != value for key, value in latched.items())):
+                mismatched.append(step)
+    return mismatched
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that every step of a Stellar Array trace seeks correctly")
+    parser.add_argument("path", help="trace file")
+    parser.add_argument("--record", metavar="MODE", help="first record a fresh headless run in this mode to PATH")
+    args = parser.parse_args(argv)
+    if args.record:
+        record_run(args.path, args.record)
+    mismatched = check(args.path)
+    if mismatched:
+        print(f"{len(mismatched)} steps seek to the wrong picture, first at step {mismatched[0]}", file=sys.stderr)
+        return 1
+    print(f"{args.path}: every step seeks correctly")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
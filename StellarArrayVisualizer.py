@@ -5,11 +5,17 @@ import random
 import math
 import threading
 import string
+import queue
+import argparse
+from collections import deque
+from StellarArray import DifferentialStream, RegisterLatched, StellarArray, ThyratronFired
+from StellarArrayTrace import FrameCoalescer, TraceReader, TraceWriter
 
 class SimulationEngine:
     def __init__(self, mode, visualizer):
         self.mode = mode
         self.vis = visualizer
+        self.machine = visualizer.machine  # Supplies grid geometry and stripe routing
         self.step_generator = self._simulation_generator()
         self.is_complete = False
 
@@ -20,7 +26,7 @@ class SimulationEngine:
             except StopIteration:
                 self.is_complete = True
                 self.vis.log("SIMULATION COMPLETE.")
-                self.vis.status_var.set("STATUS: COMPLETE")
+                self.vis.set_status("STATUS: COMPLETE")
 
     def _simulation_generator(self):
         # 1. GENERATE DATA
@@ -32,11 +38,17 @@ class SimulationEngine:
         # Tape B: Current Stream
         tape_b = []
         
-        output_log = []
+        output_log = deque(maxlen=18)  # Nixie display scrolls after 18 lines
 
         is_trading = (self.mode == "trading")
+        machine = self.machine
+        cols = machine.cols
+
+        def rows_of(calc_id):
+            first, stop = machine.stripe_bounds[calc_id]
+            return f"{first}-{stop - 1}"
         
-        for i in range(225):
+        for i in range(machine.cells):
             # Baseline
             val_a = random.randint(10, 50)
             label_a = f"A-{i:03d}"
@@ -58,6 +70,24 @@ class SimulationEngine:
             tape_a.append({"val": val_a, "label": label_a, "idx": i})
             tape_b.append({"val": val_b, "label": label_b, "idx": i})
 
+        # Run the machine itself and replay its events: the latches it performs in
+        # Phase 1 and the thyratrons it fires in Phase 2
+        latched, fired = [], {}
+
+        def on_fired(event):
+            fired[(event.row, event.col)] = event.value
+        machine.hooks.subscribe(latched.append, RegisterLatched)
+        machine.hooks.subscribe(on_fired, ThyratronFired)
+        try:
+            stream = DifferentialStream(machine, threshold=5)
+            stream.latch_baseline([item["val"] for item in tape_a])
+            for _ in stream.run([[item["val"] for item in tape_b]]):
+                pass
+        finally:
+            machine.hooks.unsubscribe(latched.append)
+            machine.hooks.unsubscribe(on_fired)
+        grid_memory = machine.flip_flops.data  # Baseline bytes, one per node
+
         # --- PHASE 1: INGEST (BLOCK A - BASELINE) ---
         self.vis.log("PHASE 1 START: INGESTING BASELINE DATA (BLOCK A)\nSystem is reading Block A from the tape to load the 'Opening Prices' into Memory.\nAction: Read Tape -> Route -> Store in Flip-Flop Grid.")
         
@@ -65,25 +95,23 @@ class SimulationEngine:
         self.vis.update_tape_display(tape_a[:10])
         yield
 
-        # Grid state to store baseline
-        grid_memory = [[0]*15 for _ in range(15)]
-        
         last_calc_id = -1
 
-        for item in tape_a:
-            idx = item['idx']
-            val = item['val']
+        for event in latched:
+            item = tape_a[event.cell]
+            idx = event.cell
+            val = event.value
             label = item['label']
             
-            row = idx // 15
-            col = idx % 15
-            calc_id = (row // 5) % 3
-            reg_id = idx % 38
+            row = idx // cols
+            col = idx % cols
+            calc_id = event.stripe
+            reg_id = event.register
             
             # --- CONTEXT SWITCH EXPLANATION ---
             if calc_id != last_calc_id:
                 if last_calc_id != -1:
-                    self.vis.log(f"ARCHITECTURAL SWITCH: CHANGING CALCULATOR UNIT\nMoving from Rows {last_calc_id*5}-{(last_calc_id*5)+4} to Rows {calc_id*5}-{(calc_id*5)+4}.\nReason: The Grid is 'Striped' across 3 parallel units to allow simultaneous access.")
+                    self.vis.log(f"ARCHITECTURAL SWITCH: CHANGING CALCULATOR UNIT\nMoving from Rows {rows_of(last_calc_id)} to Rows {rows_of(calc_id)}.\nReason: The Grid is 'Striped' across {machine.stripes} parallel units to allow simultaneous access.")
                     self.vis.highlight_calculator(calc_id, True)
                     yield
                     self.vis.highlight_calculator(calc_id, False) # Flash new unit
@@ -99,12 +127,11 @@ class SimulationEngine:
             # 1b. ROUTE for Storage
             self.vis.highlight_calculator(calc_id, True)
             self.vis.update_calc_header(calc_id, f"CALC {calc_id}: ROUTING...")
-            self.vis.log(f"STEP 2: ROUTING\nRow {row} routes to CALCULATOR {calc_id} (Responsible for Rows {calc_id*5}-{(calc_id*5)+4}).\nValue is latched into Register Bank.")
+            self.vis.log(f"STEP 2: ROUTING\nRow {row} routes to CALCULATOR {calc_id} (Responsible for Rows {rows_of(calc_id)}).\nValue is latched into Register Bank.")
             yield
             
             # 1c. LATCH GRID
             self.vis.highlight_register(calc_id, reg_id, True, val)
-            grid_memory[row][col] = val
             self.vis.update_grid_cell(row, col, "#222222", str(val), "#666666")
             self.vis.log(f"STEP 3: STORAGE\nValue {val} is latched into Grid Node [{row},{col}].\nAction Complete.")
             
@@ -115,7 +142,7 @@ class SimulationEngine:
             self.vis.highlight_calculator(calc_id, False)
             self.vis.highlight_register(calc_id, reg_id, False, val)
 
-        self.vis.log("PHASE 1 COMPLETE: MEMORY LOADED\nThe entire 15x15 Grid is now populated with Baseline Data.\nThe system is ready for the Streaming Computation phase.")
+        self.vis.log(f"PHASE 1 COMPLETE: MEMORY LOADED\nThe entire {machine.rows}x{cols} Grid is now populated with Baseline Data.\nThe system is ready for the Streaming Computation phase.")
         yield
 
         # --- PHASE 2: STREAM & COMPUTE (BLOCK B - CURRENT) ---
@@ -129,12 +156,12 @@ class SimulationEngine:
             val_curr = item['val']
             label = item['label']
             
-            row = idx // 15
-            col = idx % 15
-            calc_id = (row // 5) % 3
+            row = idx // cols
+            col = idx % cols
+            calc_id = machine.row_stripe[row]
             
             # Fetch Baseline from Memory
-            val_base = grid_memory[row][col]
+            val_base = grid_memory[idx]
             
             # 2a. READ TAPE
             self.vis.highlight_tape(True)
@@ -162,7 +189,7 @@ class SimulationEngine:
             text_color = "#666666"
             
             if is_trading:
-                if diff > 5:
+                if (row, col) in fired:
                     msg = f"BUY {label} (+{diff})"
                     cell_color = "#004400" # Green tint
                     text_color = "#00ff00"
@@ -173,10 +200,9 @@ class SimulationEngine:
                     self.vis.update_aggregator_status(f"SIGNAL DETECTED: [{row},{col}]")
                     yield
                     
-                    self.vis.log(f"AGGREGATION: Calculator 3 sweeps the signal and sends to Output.")
+                    self.vis.log(f"AGGREGATION: Calculator {machine.stripes} sweeps the signal and sends to Output.")
                     output_log.append(f"[{row},{col}] +{diff}")
-                    if len(output_log) > 18: output_log.pop(0) # SCROLL
-                    self.vis.update_output_display(output_log)
+                    self.vis.update_output_display(list(output_log))
                     
                     yield
                     self.vis.highlight_aggregator(False)
@@ -195,11 +221,104 @@ class SimulationEngine:
         self.vis.log("SIMULATION COMPLETE.")
 
 
+class DeltaChannel:
+    # Stands in for the visualizer on the engine thread: every drawing call
+    # becomes a (method, args) delta on the queue instead of touching Tk
+    def __init__(self, machine, worker):
+        self.machine = machine
+        self._worker = worker
+
+    def __getattr__(self, name):
+        def delta(*args):
+            self._worker.publish(name, args)
+        return delta
+
+
+class EngineWorker(threading.Thread):
+    # Runs a SimulationEngine off the Tk thread. Normal mode sleeps `delay`
+    # between steps; turbo steps flat out and lets the frame pump coalesce;
+    # skip runs to the end, coalescing locally and publishing one final frame.
+    # With a trace path every step is also recorded for later replay.
+    def __init__(self, mode, machine, maxsize=4096, trace=None):
+        super().__init__(daemon=True)
+        self.deltas = queue.Queue(maxsize)
+        self.trace = TraceWriter(trace, mode, machine) if trace else None
+        self.engine = SimulationEngine(mode, DeltaChannel(machine, self))
+        self.delay = 0.1
+        self.turbo = False
+        self.skip = False
+        self.stopped = False
+        self.steps = 0
+        self._wake = threading.Event()  # Set while playing or when a single step is due
+        self._single = False
+        self._local = None
+
+    def publish(self, name, args):
+        if self.trace is not None:
+            self.trace.record(name, args)
+        if self._local is not None:
+            self._local.add(name, args)
+        else:
+            self._send(name, args)
+
+    def _send(self, name, args):
+        while not self.stopped:  # Bounded queue: block while Tk catches up
+            try:
+                self.deltas.put((name, args), timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def play(self):
+        self._single = False
+        self._wake.set()
+
+    def pause(self):
+        self._wake.clear()
+
+    def step_once(self):
+        self._single = True
+        self._wake.set()
+
+    def skip_to_end(self):
+        self.skip = True
+        self.play()
+
+    def stop(self):
+        self.stopped = True
+        self._wake.set()
+
+    def run(self):
+        engine = self.engine
+        while not engine.is_complete and not self.stopped:
+            self._wake.wait()
+            if self.stopped:
+                break
+            single, self._single = self._single, False
+            if single:
+                self._wake.clear()
+            if self.skip and self._local is None:
+                self._local = FrameCoalescer()
+            engine.step()
+            self.steps += 1
+            if self.trace is not None:
+                self.trace.end_step()
+            if not (self.turbo or self.skip or single):
+                time.sleep(self.delay)
+        if self.trace is not None:
+            self.trace.close()
+        if self._local is not None:
+            local, self._local = self._local, None
+            for name, args in local.drain():
+                self._send(name, args)
 
 
 class StellarVisualizer:
-    def __init__(self, root):
+    def __init__(self, root, rows=15, cols=15, stripes=3, registers=38, record=None):
         self.root = root
+        self.machine = StellarArray(rows, cols, stripes, registers)
+        self.record = record  # Trace path written by each run, if any
+        self.replay = None
         self.root.title("Stellar Array Architecture (1946)")
         self.root.geometry("1400x900")
         self.root.configure(bg="#121212")
@@ -207,6 +326,8 @@ class StellarVisualizer:
         self.engine = None
         self.running = False
         self.speed = 0.1 # Seconds per step
+        self.fps = 30  # Frame rate for applying engine deltas
+        self.coalescer = FrameCoalescer()
         
         self.setup_ui()
 
@@ -221,6 +342,7 @@ class StellarVisualizer:
         # --- CONTROLS ---
         controls = tk.Frame(self.root, bg="#202020", pady=5)
         controls.pack(fill="x", padx=10)
+        self.controls = controls
         
         tk.Button(controls, text="START TRADING SIM", command=lambda: self.start_sim("trading")).pack(side="left", padx=5)
         
@@ -228,6 +350,10 @@ class StellarVisualizer:
         
         tk.Button(controls, text="⏯ PLAY/PAUSE", command=self.toggle_play).pack(side="left", padx=5)
         tk.Button(controls, text="⏭ STEP", command=self.step_once).pack(side="left", padx=5)
+        self.turbo_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(controls, text="TURBO", variable=self.turbo_var, command=self.toggle_turbo,
+                       fg="white", bg="#202020", selectcolor="#202020").pack(side="left", padx=5)
+        tk.Button(controls, text="⏩ SKIP TO END", command=self.skip_to_end).pack(side="left", padx=5)
         
         tk.Label(controls, text="SPEED:", fg="white", bg="#202020").pack(side="left", padx=(20,5))
         self.speed_scale = tk.Scale(controls, from_=0.01, to=1.0, resolution=0.01, orient="horizontal", bg="#202020", fg="white", length=150)
@@ -249,17 +375,18 @@ class StellarVisualizer:
         calc_frame.pack(side="left", fill="both", expand=True, padx=5)
         
         self.calcs = []
-        for i in range(3):
+        for i in range(self.machine.stripes):
+            first, stop = self.machine.stripe_bounds[i]
             cf = tk.Frame(calc_frame, bg="#1a1a1a", bd=1, relief="solid")
             cf.pack(fill="x", expand=True, pady=5, padx=5)
-            header_lbl = tk.Label(cf, text=f"CALCULATOR {i} (Rows {i*5}-{(i*5)+4})", bg="#1a1a1a", fg="#00ffff", font=("Courier", 9))
+            header_lbl = tk.Label(cf, text=f"CALCULATOR {i} (Rows {first}-{stop - 1})", bg="#1a1a1a", fg="#00ffff", font=("Courier", 9))
             header_lbl.pack(anchor="w")
             
             # Registers Grid
             reg_frame = tk.Frame(cf, bg="#1a1a1a")
             reg_frame.pack(fill="x", padx=2)
             regs = []
-            for r in range(38):
+            for r in range(len(self.machine.calculators[i].registers)):
                 lbl = tk.Label(reg_frame, text="00", bg="#000000", fg="#444444", font=("Arial", 7), width=3, relief="flat")
                 lbl.grid(row=r//10, column=r%10, padx=1, pady=1)
                 regs.append(lbl)
@@ -268,7 +395,7 @@ class StellarVisualizer:
         # CALCULATOR 3 (AGGREGATOR)
         agg_frame = tk.Frame(calc_frame, bg="#1a1a1a", bd=1, relief="solid")
         agg_frame.pack(fill="x", expand=True, pady=5, padx=5)
-        agg_header = tk.Label(agg_frame, text="CALCULATOR 3 (AGGREGATOR)", bg="#1a1a1a", fg="#ff00ff", font=("Courier", 9))
+        agg_header = tk.Label(agg_frame, text=f"CALCULATOR {self.machine.stripes} (AGGREGATOR)", bg="#1a1a1a", fg="#ff00ff", font=("Courier", 9))
         agg_header.pack(anchor="w")
         self.aggregator = {"frame": agg_frame, "header": agg_header}
         
@@ -277,7 +404,7 @@ class StellarVisualizer:
         self.agg_status.pack(fill="x", padx=5, pady=5)
 
         # COL 3: GRID
-        grid_frame = tk.LabelFrame(main, text="15x15 ARRAY (MEMORY)", bg="#121212", fg="#00ff00", font=("Courier", 10, "bold"))
+        grid_frame = tk.LabelFrame(main, text=f"{self.machine.rows}x{self.machine.cols} ARRAY (MEMORY)", bg="#121212", fg="#00ff00", font=("Courier", 10, "bold"))
         grid_frame.pack(side="left", fill="both", expand=True, padx=5)
         self.grid_canvas = tk.Canvas(grid_frame, bg="black", highlightthickness=0)
         self.grid_canvas.pack(fill="both", expand=True, padx=5, pady=5)
@@ -300,44 +427,129 @@ class StellarVisualizer:
         self.log_lbl = tk.Label(log_frame, text="READY", font=("Courier", 14), fg="#00ff00", bg="black", anchor="nw", justify="left", padx=10, pady=5)
         self.log_lbl.pack(fill="both", expand=True)
 
+    def stop_engine(self):
+        # Wait for the old worker to leave the shared machine and close its trace
+        # before anything else touches either
+        if self.engine:
+            self.engine.stop()
+            self.engine.join(timeout=2.0)
+            self.engine = None
+
     def start_sim(self, mode):
-        self.engine = SimulationEngine(mode, self)
+        self.stop_engine()
+        self.close_replay()
+        self.engine = EngineWorker(mode, self.machine, trace=self.record)
+        self.engine.turbo = self.turbo_var.get()
+        self.coalescer.drain()
         self.running = False
-        self.status_var.set("STATUS: READY - PRESS PLAY OR STEP")
+        self.set_status("STATUS: READY - PRESS PLAY OR STEP")
         self.draw_grid_layout()
         self.reset_visuals()
+        self.engine.start()
+        if not getattr(self, "_pumping", False):
+            self._pumping = True
+            self.pump_frames()
 
     def toggle_play(self):
         if not self.engine: return
         self.running = not self.running
         if self.running:
-            self.status_var.set("STATUS: RUNNING")
-            self.run_loop()
+            self.set_status("STATUS: RUNNING")
+            self.engine.play()
         else:
-            self.status_var.set("STATUS: PAUSED")
+            self.set_status("STATUS: PAUSED")
+            self.engine.pause()
 
     def step_once(self):
         if not self.engine: return
         self.running = False
-        self.status_var.set("STATUS: PAUSED (STEPPED)")
-        self.engine.step()
+        self.set_status("STATUS: PAUSED (STEPPED)")
+        self.engine.pause()
+        self.engine.step_once()
 
-    def run_loop(self):
-        if self.running and self.engine and not self.engine.is_complete:
-            self.engine.step()
-            delay = int(self.speed_scale.get() * 1000)
-            self.root.after(delay, self.run_loop)
+    def toggle_turbo(self):
+        if self.engine:
+            self.engine.turbo = self.turbo_var.get()
+
+    def skip_to_end(self):
+        if not self.engine: return
+        self.running = True
+        self.set_status("STATUS: SKIPPING TO END")
+        self.engine.skip_to_end()
+
+    def load_trace(self, path):
+        # Replay mode: a slider seeks to any step of a recorded run
+        reader = TraceReader(path)
+        if (reader.rows, reader.cols, reader.stripes) != (self.machine.rows, self.machine.cols, self.machine.stripes):
+            reader.close()
+            raise ValueError(f"Trace geometry {reader.rows}x{reader.cols}/{reader.stripes} does not match the display")
+        self.stop_engine()
+        self.close_replay()
+        self.replay = reader
+        self.running = False
+        self.replay_scale = tk.Scale(self.controls, from_=0, to=reader.steps, orient="horizontal", label="REPLAY STEP",
+                                     bg="#202020", fg="white", length=300,
+                                     command=lambda step: self.seek_trace(int(step)))
+        self.replay_scale.pack(side="left", padx=(20, 5))
+        self.seek_trace(0)
+
+    def seek_trace(self, step):
+        state = self.replay.seek(step)
+        self.draw_grid_layout()
+        self.blank_visuals()
+        for name, args in state.deltas:
+            getattr(self, name)(*args)
+        self.set_status(f"STATUS: REPLAY {self.replay.mode.upper()} STEP {step}/{self.replay.steps}")
+
+    def close_replay(self):
+        if self.replay:
+            self.replay_scale.destroy()
+            self.replay.close()
+            self.replay = None
+
+    def blank_visuals(self):
+        # Every widget back to its start-up look, so a replayed picture does not
+        # inherit anything drawn for a later step
+        self.reset_visuals()
+        for i, calc in enumerate(self.calcs):
+            first, stop = self.machine.stripe_bounds[i]
+            calc['header'].config(text=f"CALCULATOR {i} (Rows {first}-{stop - 1})")
+        self.log("READY")
+        self.update_tape_display([])
+        self.update_output_display([])
+        self.highlight_tape(False)
+        self.highlight_aggregator(False)
+        self.update_aggregator_status("WAITING FOR SIGNAL...")
+
+    def pump_frames(self):
+        # Drain the engine's deltas and apply one coalesced frame per tick
+        engine = self.engine
+        if engine:
+            engine.delay = self.speed_scale.get()
+            deltas = engine.deltas
+            for _ in range(deltas.maxsize):
+                try:
+                    name, args = deltas.get_nowait()
+                except queue.Empty:
+                    break
+                self.coalescer.add(name, args)
+            for name, args in self.coalescer.drain():
+                getattr(self, name)(*args)
+        self.root.after(1000 // self.fps, self.pump_frames)
 
     # --- VISUALIZATION HELPERS ---
+    def set_status(self, text):
+        self.status_var.set(text)
+
     def log(self, msg):
         self.log_lbl.config(text=f"> {msg}")
 
     def draw_grid_layout(self):
         self.grid_canvas.delete("all")
         w = 500
-        cell = w / 15
-        for i in range(15):
-            for j in range(15):
+        cell = w / max(self.machine.rows, self.machine.cols)
+        for i in range(self.machine.rows):
+            for j in range(self.machine.cols):
                 x1, y1 = j*cell, i*cell
                 x2, y2 = x1+cell-2, y1+cell-2
                 self.grid_cells[(i,j)] = self.grid_canvas.create_rectangle(x1, y1, x2, y2, fill="#111111", outline="")
@@ -372,11 +584,13 @@ class StellarVisualizer:
         self.calcs[calc_id]['frame'].config(bg=color)
 
     def highlight_register(self, calc_id, reg_id, on, val):
+        # Both branches set the text, so the last call for a register carries its
+        # whole look and the frame coalescer can drop the earlier ones
         reg = self.calcs[calc_id]['regs'][reg_id]
         if on:
             reg.config(bg="#00ff00", fg="black", text=str(val))
         else:
-            reg.config(bg="#333333", fg="white") # Keep value visible but dim
+            reg.config(bg="#333333", fg="white", text=str(val)) # Keep value visible but dim
 
     def update_calc_header(self, calc_id, text):
         self.calcs[calc_id]['header'].config(text=text)
@@ -394,6 +608,16 @@ class StellarVisualizer:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stellar Array visualizer")
+    parser.add_argument("--record", help="write a trace of each run to this file")
+    parser.add_argument("--replay", help="open a recorded trace instead of running live")
+    args = parser.parse_args()
     root = tk.Tk()
-    app = StellarVisualizer(root)
+    if args.replay:
+        with TraceReader(args.replay) as trace:
+            geometry = (trace.rows, trace.cols, trace.stripes, trace.registers)
+        app = StellarVisualizer(root, *geometry)
+        app.load_trace(args.replay)
+    else:
+        app = StellarVisualizer(root, record=args.record)
     root.mainloop()